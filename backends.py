@@ -0,0 +1,316 @@
+# 后端适配器：每个后端负责构造请求和解析一行流式响应，run_generation 是所有后端共用的生成循环
+# gateway.py、connAgent.py 和 local-lama.py 都基于这里的后端，调度和SSE/WebSocket转发由各自的应用处理
+import json
+import logging
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from credential_pool import CredentialPool
+from ollama_options import apply_num_ctx, parse_ollama_options
+from upstream_guard import UpstreamPool, hedged_lines
+
+logger = logging.getLogger(__name__)
+
+
+def create_session(pool_size=32):
+    """所有后端共用的HTTP连接池，与上游保持长连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class Backend:
+    """
+    后端适配器基类。prepare() 返回 (上游列表, open_stream)，交给 hedged_lines 发起请求；
+    parse(line) 把一行响应解析为 (文本或None, 是否结束)。
+    有回答缓存的后端实现 cached_reply() 和 remember()。
+    """
+
+    name = None
+    # 没有传入文本时使用的默认文本
+    default_text = "Hello, how are you?"
+
+    def __init__(self, session, max_running=1):
+        self.session = session
+        self.max_running = max_running
+        self.upstream_pool = UpstreamPool()
+
+    def healthy(self):
+        # 还没有请求过的后端视为可用；否则至少一个上游的熔断器会放行
+        upstreams = list(self.upstream_pool.upstreams.values())
+        return not upstreams or any(u.breaker.available() for u in upstreams)
+
+    def prepare(self, text, options, trace):
+        raise NotImplementedError
+
+    def parse(self, line):
+        raise NotImplementedError
+
+    def describe(self):
+        """生成开始时显示给用户的后端说明"""
+        return f"使用后端: {self.name}"
+
+    def cached_reply(self, text, options, trace):
+        """返回 (缓存的回答或None, 相似度, 查找状态)，查找状态在生成完成后原样传给 remember()"""
+        return None, 0.0, None
+
+    def remember(self, text, options, reply, lookup_state):
+        """保存完整生成的回答"""
+
+    def status(self):
+        return {'max_running': self.max_running, 'healthy': self.healthy(), 'upstreams': self.upstream_pool.status()}
+
+
+class HunyuanBackend(Backend):
+    """腾讯元器智能体接口，SSE格式（data: 开头的JSON行）；url、assistant_id、token 等从 my.ini 读取"""
+
+    name = 'hunyuan'
+    default_url = 'https://open.hunyuan.tencent.com/openapi/v1/agent/chat/completions'
+    default_text = "Is life so dear or peace so sweet as to be purchased at the price of chains and slavery? Forbid it, Almighty God! I know not what course others may take; but as for me, give me liberty or give me death!"
+
+    def __init__(self, session, max_running=2, config_path='my.ini'):
+        super().__init__(session, max_running)
+        self.config_path = config_path
+        self.credential_pool = CredentialPool()
+
+    def _read_config(self):
+        # 多组 assistant_id/token 按出现顺序配对组成凭据池，多行 url= 为备用上游
+        assistant_ids = []
+        tokens = []
+        urls = []
+        rate_per_minute = None
+        burst = None
+        try:
+            with open(self.config_path, 'r') as f:
+                for line in f:
+                    if line.startswith('assistant_id'):
+                        assistant_ids.append(line.split('=')[1].strip())
+                    elif line.startswith('token'):
+                        tokens.append(line.split('=', 1)[1].strip())
+                    elif line.startswith('url'):
+                        urls.append(line.split('=', 1)[1].strip())
+                    elif line.startswith('rate_per_minute'):
+                        rate_per_minute = float(line.split('=')[1].strip())
+                    elif line.startswith('burst'):
+                        burst = int(line.split('=')[1].strip())
+        except Exception as e:
+            logger.warning(f"读取配置文件时出错: {e}")
+        pairs = list(zip(assistant_ids, tokens)) or [("智能体id", "<元器用户的token>")]
+        self.credential_pool.configure(pairs, rate_per_minute, burst)
+        return urls or [self.default_url]
+
+    def prepare(self, text, options, trace):
+        with trace.span('config'):
+            urls = self._read_config()
+        with trace.span('credential_wait'):
+            credential = self.credential_pool.acquire_or_raise()
+
+        data = {
+            "user_id": "username",
+            "stream": True,
+            "messages": [{"role": "user", "content": [{"type": "text", "text": text}]}]
+        }
+
+        first_credential = [credential]
+
+        def open_stream(upstream):
+            # 第一个请求使用排队取得的凭据，对冲请求各自取一个令牌，没有余量时不对冲
+            try:
+                credential = first_credential.pop()
+            except IndexError:
+                credential = self.credential_pool.acquire_or_raise(timeout=0)
+            for _ in range(len(self.credential_pool)):
+                headers = {
+                    'X-Source': 'openapi',
+                    'Content-Type': 'application/json',
+                    'Authorization': f'Bearer {credential.token}'
+                }
+                connect_started = time.perf_counter()
+                response = self.session.post(
+                    upstream.url, headers=headers, json=dict(data, assistant_id=credential.assistant_id),
+                    stream=True, timeout=(5, 120)
+                )
+                trace.add('connect', connect_started, url=upstream.url, status=response.status_code)
+                if response.status_code != 429:
+                    return response
+                # 当前凭据被限流，换一个有余量的凭据重试
+                response.close()
+                self.credential_pool.report_rate_limited(credential, response.headers.get('Retry-After'))
+                next_credential = self.credential_pool.acquire()
+                if next_credential is None:
+                    break
+                credential = next_credential
+            return response
+
+        return self.upstream_pool.select(urls), open_stream
+
+    def parse(self, line):
+        chunk_str = line.decode('utf-8')
+        if chunk_str.startswith('data:'):
+            chunk_str = chunk_str[5:].strip()
+        if chunk_str == '[DONE]':
+            return None, True
+        try:
+            chunk_data = json.loads(chunk_str)
+        except json.JSONDecodeError:
+            # 不是有效的JSON，直接返回原始内容
+            return f" {chunk_str}", False
+        if 'choices' in chunk_data and chunk_data['choices']:
+            choice = chunk_data['choices'][0]
+            if 'delta' in choice and 'content' in choice['delta']:
+                return choice['delta']['content'], False
+            if 'message' in choice and 'content' in choice['message']:
+                return choice['message']['content'], False
+        return None, False
+
+    def describe(self):
+        return "使用腾讯元器智能体"
+
+    def status(self):
+        return {**super().status(), 'credentials': self.credential_pool.status()}
+
+
+class OllamaBackend(Backend):
+    """
+    Ollama /api/generate 接口，NDJSON格式；第一个服务器为主服务器，其余为对冲备用。
+    传入 semantic_cache 时相近的提示直接返回缓存的回答。
+    """
+
+    name = 'ollama'
+
+    def __init__(self, session, servers, model='english-expert:latest', max_running=1, semantic_cache=None):
+        super().__init__(session, max_running)
+        self.servers = servers
+        self.model = model
+        self.semantic_cache = semantic_cache
+
+    def _options(self, text, options):
+        # 透传Ollama options，num_ctx=auto 时按提示长度自动选择
+        return apply_num_ctx(text, parse_ollama_options(options or {}))
+
+    def _cache_key(self, options):
+        # 模型和影响输出的参数相同的提示才能共用缓存；num_ctx只影响上下文长度，不计入
+        return json.dumps({'model': self.model, 'options': {k: v for k, v in options.items() if k != 'num_ctx'}}, sort_keys=True)
+
+    def describe(self):
+        return f"使用模型: {self.model}"
+
+    def cached_reply(self, text, options, trace):
+        if self.semantic_cache is None:
+            return None, 0.0, None
+        with trace.span('semantic_cache'):
+            entry, score, vector = self.semantic_cache.lookup(text, self._cache_key(self._options(text, options)))
+        if entry is None:
+            return None, score, vector
+        logger.info(f"命中语义缓存，相似度 {score:.3f}，原提示: {entry['prompt'][:50]}...")
+        return entry['response'], score, vector
+
+    def remember(self, text, options, reply, lookup_state):
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(text, reply, self._cache_key(self._options(text, options)), lookup_state)
+
+    def prepare(self, text, options, trace):
+        # 先检查模型是否存在，服务不可达时只记录警告，由后面的请求报告连接错误
+        try:
+            with trace.span('tags_check'):
+                response = self.session.get(f'http://{self.servers[0]}:11434/api/tags', timeout=5)
+            if response.status_code == 200:
+                model_names = [model.get('name', '') for model in response.json().get('models', [])]
+                if self.model not in model_names:
+                    raise RuntimeError(f"模型 '{self.model}' 不存在。可用模型: {', '.join(model_names)}")
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"检查Ollama服务时出错: {e}")
+
+        data = {"model": self.model, "prompt": text, "stream": True}
+        options = self._options(text, options)
+        if options:
+            data['options'] = options
+
+        def open_stream(upstream):
+            connect_started = time.perf_counter()
+            response = self.session.post(upstream.url, json=data, stream=True, timeout=(5, 120))
+            trace.add('connect', connect_started, url=upstream.url, status=response.status_code)
+            return response
+
+        urls = [f'http://{ip}:11434/api/generate' for ip in self.servers]
+        return self.upstream_pool.select(urls), open_stream
+
+    def parse(self, line):
+        try:
+            chunk_data = json.loads(line.decode('utf-8').strip())
+        except json.JSONDecodeError:
+            return f"[原始数据: {line[:100]!r}]", False
+        return chunk_data.get('response') or None, chunk_data.get('done', False)
+
+
+def run_generation(backend, store, generation_id, user_text, options, trace):
+    """
+    所有后端共用的生成循环：上游请求和对冲由 hedged_lines 处理，每行响应交给后端解析，
+    内容写入 store，结束时记录状态并结束 trace。
+    """
+    error = None
+    text = user_text or backend.default_text
+
+    def update_response(content):
+        store.append(generation_id, content)
+        logger.debug(f"添加响应: {content[:50]}...")
+
+    update_response(f"{backend.describe()}<br>")
+    try:
+        # 先查缓存，命中时直接返回缓存的回答
+        cached, score, lookup_state = backend.cached_reply(text, options, trace)
+        if cached is not None:
+            trace.attrs['cache_hit'] = round(score, 3)
+            update_response(f"命中语义缓存（相似度 {score:.3f}）<br>")
+            update_response(cached.replace('\n', '<br>'))
+            update_response("<br>流式响应接收完成<br>")
+            return
+
+        upstreams, open_stream = backend.prepare(text, options, trace)
+        request_started = time.perf_counter()
+        first_chunk = None
+        chunk_count = 0
+        reply_parts = []
+        completed = False
+        for upstream, line in hedged_lines(upstreams, open_stream):
+            if not line:
+                continue
+            if first_chunk is None:
+                first_chunk = time.perf_counter()
+                trace.add('ttft', request_started, first_chunk, url=upstream.url)
+            chunk_count += 1
+            parse_started = time.perf_counter()
+            content, done = backend.parse(line)
+            trace.count('parse', time.perf_counter() - parse_started)
+            if content:
+                reply_parts.append(content)
+                update_response(content.replace('\n', '<br>'))
+            if done:
+                completed = True
+                break
+
+        if first_chunk is not None:
+            trace.add('stream', first_chunk, chunks=chunk_count)
+        # 只缓存完整生成的回答
+        if completed and reply_parts:
+            backend.remember(text, options, ''.join(reply_parts), lookup_state)
+        if chunk_count == 0:
+            update_response("<br>警告: 未收到任何有效响应数据<br>")
+        else:
+            update_response("<br>流式响应接收完成<br>")
+
+    except requests.exceptions.RequestException as e:
+        error = f"请求出错: {e}"
+        logger.error(error)
+        update_response(f"<br>错误: {error}<br>")
+    except Exception as e:
+        error = f"发生错误: {e}"
+        logger.error(error, exc_info=True)
+        update_response(f"<br>错误: {error}<br>")
+    finally:
+        store.finish(generation_id, error)
+        trace.finish(error=error)
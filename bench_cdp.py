@@ -0,0 +1,216 @@
+# CDP自动化链路的离线基准测试：用本地模拟聊天页（mock_chat.html）代替元宝，
+# 启动无头Chromium，用N个标签页并发提问，统计输入到首段文本的延迟、每个问题的端到端耗时和CDP命令往返耗时分位数
+# 用法:
+#   CHROME_PATH=/usr/bin/chromium BENCH_TABS=4 BENCH_PROMPTS=40 python bench_cdp.py
+# 设置 REPLY_SOURCE=network 时从网络响应读取回复，默认从页面内容读取；BLOCK_RESOURCES=0 关闭资源屏蔽
+import asyncio
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# browser_backend 导入时会打开生成状态库，基准测试使用临时目录中的库
+os.environ.setdefault('STATE_DB', os.path.join(tempfile.gettempdir(), 'bench_cdp_state.db'))
+
+import browser_backend
+from browser_backend import TabPool, ask
+from xpath_simple_debug import percentile
+
+logger = logging.getLogger(__name__)
+
+# 标签页数量（同时进行的提问数）
+BENCH_TABS = int(os.environ.get('BENCH_TABS', 4))
+# 提问总数
+BENCH_PROMPTS = int(os.environ.get('BENCH_PROMPTS', 40))
+# 模拟接口返回的回复段数和每段之间的间隔（秒）
+MOCK_TOKENS = int(os.environ.get('MOCK_TOKENS', 20))
+MOCK_TOKEN_DELAY = float(os.environ.get('MOCK_TOKEN_DELAY', 0.02))
+# 模拟页面和Chromium调试端口
+MOCK_PORT = int(os.environ.get('MOCK_PORT', 8765))
+BENCH_DEBUG_PORT = int(os.environ.get('BENCH_DEBUG_PORT', 9223))
+# 页面内容模式下回复静默多久视为结束；模拟回复是连续输出的，可以比线上设置短
+BENCH_QUIET_SECONDS = float(os.environ.get('BENCH_QUIET_SECONDS', 0.5))
+
+MOCK_PAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_chat.html')
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    """GET /chat 返回模拟页面，POST /api/chat/... 以SSE流返回模拟回复"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/chat':
+            self.send_error(404)
+            return
+        with open(MOCK_PAGE_PATH, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.startswith('/api/chat/'):
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        prompt = json.loads(self.rfile.read(length) or b'{}').get('prompt', '')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        for i in range(MOCK_TOKENS):
+            time.sleep(MOCK_TOKEN_DELAY)
+            msg = f"模拟回复（{len(prompt)}字）" if i == 0 else f" 第{i}段"
+            event = json.dumps({'type': 'text', 'msg': msg}, ensure_ascii=False)
+            self.wfile.write(f"data: {event}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def find_chrome():
+    path = os.environ.get('CHROME_PATH')
+    if path:
+        return path
+    for name in ('chromium', 'chromium-browser', 'google-chrome', 'google-chrome-stable', 'chrome'):
+        found = shutil.which(name)
+        if found:
+            return found
+    return None
+
+
+def launch_chrome(chrome_path, user_data_dir):
+    args = [
+        chrome_path,
+        '--headless=new',
+        f'--remote-debugging-port={BENCH_DEBUG_PORT}',
+        f'--user-data-dir={user_data_dir}',
+        '--no-first-run',
+        '--no-default-browser-check',
+        '--disable-gpu',
+        '--disable-extensions',
+        'about:blank',
+    ]
+    # 容器里以root运行时Chromium要求关闭沙箱
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        args.insert(1, '--no-sandbox')
+    return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for_debug_port(timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{BENCH_DEBUG_PORT}/json/version', timeout=1).ok:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+async def run_prompts(pool, count):
+    """同时进行的提问数等于标签页数，计时不包含等待空闲标签页的时间"""
+    slots = asyncio.Semaphore(pool.size)
+    results = []
+
+    async def one(index):
+        async with slots:
+            started = time.monotonic()
+            first_text = []
+
+            def on_delta(delta):
+                if not first_text:
+                    first_text.append(time.monotonic())
+
+            try:
+                await ask(pool, f"基准测试问题 {index}：请把这句话翻译成英文。", on_delta)
+            except Exception as e:
+                logger.error(f"第 {index} 个问题失败: {e}")
+                results.append({'error': str(e)})
+                return
+            results.append({
+                'first_text_ms': (first_text[0] - started) * 1000 if first_text else None,
+                'total_ms': (time.monotonic() - started) * 1000,
+            })
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return results
+
+
+def summarize(name, samples):
+    if not samples:
+        return f"{name}: 无样本"
+    parts = ' '.join(f"p{q}={percentile(samples, q):.1f}" for q in (50, 90, 99))
+    return f"{name}: n={len(samples)} {parts} max={max(samples):.1f} ms"
+
+
+async def main():
+    chrome_path = find_chrome()
+    if not chrome_path:
+        logger.error("未找到Chromium，请设置环境变量 CHROME_PATH")
+        return
+
+    server = ThreadingHTTPServer(('127.0.0.1', MOCK_PORT), MockChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    user_data_dir = tempfile.mkdtemp(prefix='bench_cdp_')
+    chrome = launch_chrome(chrome_path, user_data_dir)
+    pool = None
+    try:
+        if not await asyncio.to_thread(wait_for_debug_port):
+            logger.error(f"Chromium调试端口未就绪: {chrome_path}")
+            return
+
+        browser_backend.REPLY_QUIET_SECONDS = BENCH_QUIET_SECONDS
+        pool = TabPool(
+            size=BENCH_TABS,
+            page_url=f'http://127.0.0.1:{MOCK_PORT}/chat',
+            debug_host=f'127.0.0.1:{BENCH_DEBUG_PORT}',
+        )
+        opened = await pool.start()
+        if not opened:
+            logger.error("没有可用的标签页")
+            return
+        # 只统计提问期间的命令往返耗时
+        pool.browser.rtt_samples.clear()
+
+        started = time.monotonic()
+        results = await run_prompts(pool, BENCH_PROMPTS)
+        elapsed = time.monotonic() - started
+
+        succeeded = [r for r in results if 'error' not in r]
+        logger.info(f"回复来源: {browser_backend.REPLY_SOURCE}，标签页: {opened}，问题: {len(results)}，失败: {len(results) - len(succeeded)}")
+        logger.info(f"总耗时: {elapsed:.2f} 秒，吞吐: {len(succeeded) / elapsed:.2f} 问/秒")
+        logger.info(summarize("输入到首段文本", [r['first_text_ms'] for r in succeeded if r['first_text_ms'] is not None]))
+        logger.info(summarize("端到端", [r['total_ms'] for r in succeeded]))
+        logger.info(summarize("CDP命令往返", list(pool.browser.rtt_samples)))
+        stats = pool.browser.stats()
+        logger.info(f"CDP命令: {stats['commands']}，超时: {stats['timeouts']}，错误: {stats['errors']}，事件: {stats['events']}")
+        metrics = await pool.metrics()
+        logger.info(f"标签页JS堆合计: {metrics['js_heap_used_mb_total']} MB")
+    finally:
+        if pool is not None:
+            await pool.close()
+        chrome.terminate()
+        try:
+            chrome.wait(10)
+        except subprocess.TimeoutExpired:
+            chrome.kill()
+        server.shutdown()
+        shutil.rmtree(user_data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # 提问过程中的逐条日志太多，只保留警告
+    logging.getLogger('xpath_simple_debug').setLevel(logging.WARNING)
+    asyncio.run(main())
@@ -0,0 +1,482 @@
+# 浏览器翻译后端：维护一组已加载、已连接的元宝标签页，每个请求借用一个空闲标签页
+# 先用以下方式启动Chromium（见 记录.txt）:
+#   chrome.exe --remote-debugging-port=9222 --user-data-dir=...
+# 然后运行 python browser_backend.py，访问 http://localhost:5001/?text=你的问题 查看流式回复，
+# 或 http://localhost:5001/translate?text=你的问题 直接获取完整回复
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from flask import Flask, Response, render_template_string, request
+
+from generation_store import GenerationStore
+from push_channel import event_stream, register_websocket
+
+from xpath_simple_debug import (
+    CHAT_API_URL_PATTERN,
+    CHAT_PAGE_URL,
+    DEBUG_HOST,
+    EDITOR_CSS_SELECTOR,
+    FEEDBACK_CSS_SELECTOR,
+    REPLY_CSS_SELECTOR,
+    SUBMIT_BUTTON_CSS_SELECTOR,
+    ReplyReplace,
+    click_element,
+    connect_browser,
+    input_text_in_element,
+)
+
+logger = logging.getLogger(__name__)
+
+# 标签页池大小
+POOL_SIZE = 4
+# 等待空闲标签页的最长时间
+ACQUIRE_TIMEOUT = 30
+# 补充标签页失败后多久再重试
+REFILL_RETRY_SECONDS = 5
+# 标签页使用多少次后关闭并换一个新的，限制渲染进程的内存增长
+TAB_MAX_USES = int(os.environ.get('TAB_MAX_USES', 50))
+# 等待回复结束的最长时间
+REPLY_TIMEOUT = 120
+# 回复内容连续多少秒没有变化视为结束
+REPLY_QUIET_SECONDS = 1.5
+# 单个请求的最长处理时间
+REQUEST_TIMEOUT = REPLY_TIMEOUT + 30
+# 回复来源: dom 从页面内容读取，network 直接读取聊天接口的流式响应
+REPLY_SOURCE = os.environ.get('REPLY_SOURCE', 'dom')
+# 是否屏蔽自动化标签页用不到的资源，减少每个标签页的内存和CPU；设置 BLOCK_RESOURCES=0 关闭
+BLOCK_RESOURCES = os.environ.get('BLOCK_RESOURCES', '1') != '0'
+# 屏蔽的资源类型（CDP Network.ResourceType）
+BLOCKED_RESOURCE_TYPES = ['Image', 'Media', 'Font']
+# 屏蔽的URL模式（统计、监控上报等）
+BLOCKED_URL_PATTERNS = [
+    '*://aegis.qq.com/*',
+    '*://*.beacon.qq.com/*',
+    '*google-analytics.com/*',
+    '*googletagmanager.com/*',
+]
+# 没有传入文本时使用的默认文本
+DEFAULT_TEXT = "Hello, how are you?"
+
+
+class Tab:
+    """一个已附加到浏览器连接上的标签页"""
+
+    def __init__(self, target_id, client):
+        self.target_id = target_id
+        self.client = client
+        self.uses = 0
+        self.busy = False
+
+    def is_healthy(self):
+        # 会话被分离或浏览器连接断开都视为不可用
+        return self.client.is_connected()
+
+
+class TabPool:
+    """
+    标签页池。所有标签页通过同一个浏览器级WebSocket以会话方式驱动。
+    start() 打开并预热 size 个标签页；acquire() 借出一个空闲且连接正常的标签页，
+    release() 归还，归还的标签页先重新打开聊天页面开始新对话再放回空闲队列，
+    断开或使用超过 TAB_MAX_USES 次的标签页会被关闭，缺少的标签页在后台补充。
+    """
+
+    def __init__(self, size=POOL_SIZE, page_url=CHAT_PAGE_URL, debug_host=DEBUG_HOST, block_resources=BLOCK_RESOURCES):
+        self.size = size
+        self.page_url = page_url
+        self.debug_host = debug_host
+        self.block_resources = block_resources
+        self.browser = None
+        self.browser_lock = asyncio.Lock()
+        self.tabs = []
+        self.idle = asyncio.Queue()
+        self.replaced = 0
+        # 正在后台打开的标签页数量，以及补充失败后下次重试的时间
+        self.opening = 0
+        self.refill_after = 0.0
+        self.tasks = set()
+
+    async def _ensure_browser(self):
+        # 浏览器连接断开时重新连接，所有标签页共用这一个连接
+        async with self.browser_lock:
+            if self.browser is None or not self.browser.is_connected():
+                if self.browser is not None:
+                    await self.browser.close()
+                self.browser = await connect_browser(self.debug_host)
+            return self.browser
+
+    async def start(self):
+        # 并发打开并预热所有标签页
+        tabs = await asyncio.gather(*(self._open_tab() for _ in range(self.size)))
+        for tab in tabs:
+            if tab is not None:
+                self.tabs.append(tab)
+                self.idle.put_nowait(tab)
+        logger.info(f"标签页池已就绪: {len(self.tabs)}/{self.size}")
+        return len(self.tabs)
+
+    async def _open_tab(self):
+        """打开一个标签页并等待输入框出现，任何一步失败都关闭标签页并返回None"""
+        browser = await self._ensure_browser()
+        if browser is None:
+            logger.error("无法连接浏览器调试端口")
+            return None
+        target_id = None
+        client = None
+        try:
+            # 先打开空白页，开启资源屏蔽后再导航，页面加载的第一批请求也能被拦截
+            target_id = await browser.create_target('about:blank')
+            if not target_id:
+                return None
+            client = await browser.attach(target_id)
+            if client is None:
+                await browser.close_target(target_id)
+                return None
+            tab = Tab(target_id, client)
+            if self.block_resources:
+                await client.enable_blocking(BLOCKED_RESOURCE_TYPES, BLOCKED_URL_PATTERNS)
+            if await self._load_chat(tab):
+                return tab
+            logger.warning(f"标签页 {target_id} 未找到输入框，关闭")
+            await self._close_tab(tab)
+            return None
+        except Exception as e:
+            logger.error(f"打开标签页失败: {e}")
+            if client is not None:
+                await client.close()
+            if target_id and browser.is_connected():
+                await browser.close_target(target_id)
+            return None
+
+    async def _load_chat(self, tab):
+        """打开聊天页面并等待加载完成且输入框出现；页面上之前的对话随之丢弃"""
+        if not await tab.client.navigate(self.page_url):
+            logger.warning(f"标签页 {tab.target_id} 导航失败: {self.page_url}")
+        return await tab.client.wait_for_load() and await tab.client.wait_for_selector(EDITOR_CSS_SELECTOR)
+
+    async def _close_tab(self, tab):
+        await tab.client.close()
+        if self.browser is not None and self.browser.is_connected():
+            await self.browser.close_target(tab.target_id)
+
+    def _refill(self):
+        """标签页少于 size 个时在后台补充；补充失败后 REFILL_RETRY_SECONDS 秒内不再重试"""
+        loop = asyncio.get_running_loop()
+        if loop.time() < self.refill_after:
+            return
+        while len(self.tabs) + self.opening < self.size:
+            self.opening += 1
+            task = loop.create_task(self._add_tab())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _add_tab(self):
+        try:
+            tab = await self._open_tab()
+        finally:
+            self.opening -= 1
+        if tab is None:
+            self.refill_after = asyncio.get_running_loop().time() + REFILL_RETRY_SECONDS
+            return
+        self.replaced += 1
+        self.tabs.append(tab)
+        self.idle.put_nowait(tab)
+
+    async def _discard(self, tab, reason="连接已断开"):
+        logger.warning(f"标签页 {tab.target_id} {reason}，重新创建")
+        if tab in self.tabs:
+            self.tabs.remove(tab)
+        await self._close_tab(tab)
+        self._refill()
+
+    async def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        # 借出前检查连接，浏览器重连后断开的标签页直接替换，不让用户请求失败
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._refill()
+        while True:
+            tab = await asyncio.wait_for(self.idle.get(), max(0.0, deadline - loop.time()))
+            if tab.is_healthy():
+                tab.busy = True
+                tab.uses += 1
+                return tab
+            await self._discard(tab)
+
+    async def release(self, tab):
+        tab.busy = False
+        if not tab.is_healthy():
+            await self._discard(tab)
+        elif tab.uses >= TAB_MAX_USES:
+            await self._discard(tab, f"已使用 {tab.uses} 次")
+        else:
+            # 在后台开始新对话，不拖慢本次请求的返回
+            task = asyncio.get_running_loop().create_task(self._reset(tab))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _reset(self, tab):
+        """
+        重新打开聊天页面后放回空闲队列。不开新对话的话，之前其他用户的提问会成为后续提问的上下文，
+        #chat-content 也会越来越长，标签页内存和 watchReply 的扫描量随之增长。
+        """
+        try:
+            ready = await self._load_chat(tab)
+        except Exception as e:
+            logger.error(f"标签页 {tab.target_id} 开始新对话失败: {e}")
+            ready = False
+        if ready and tab.is_healthy():
+            self.idle.put_nowait(tab)
+        else:
+            await self._discard(tab, "无法开始新对话")
+
+    @asynccontextmanager
+    async def tab(self, timeout=ACQUIRE_TIMEOUT):
+        tab = await self.acquire(timeout)
+        try:
+            yield tab
+        finally:
+            await self.release(tab)
+
+    async def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        for tab in self.tabs:
+            await self._close_tab(tab)
+        self.tabs = []
+        if self.browser is not None:
+            await self.browser.close()
+
+    async def metrics(self):
+        """各标签页的 Performance.getMetrics 指标，用于比较开关资源屏蔽时一个浏览器能容纳多少标签页"""
+        tabs = list(self.tabs)
+        results = await asyncio.gather(*(tab.client.get_metrics() for tab in tabs))
+        report = []
+        for tab, metrics in zip(tabs, results):
+            report.append({
+                'target_id': tab.target_id,
+                'busy': tab.busy,
+                'blocked_requests': tab.client.blocked_requests,
+                'js_heap_used_mb': round(metrics.get('JSHeapUsedSize', 0) / 1048576, 2),
+                'js_heap_total_mb': round(metrics.get('JSHeapTotalSize', 0) / 1048576, 2),
+                'nodes': metrics.get('Nodes'),
+                'documents': metrics.get('Documents'),
+                'frames': metrics.get('Frames'),
+                'layout_count': metrics.get('LayoutCount'),
+            })
+        return {
+            'block_resources': self.block_resources,
+            'js_heap_used_mb_total': round(sum(t['js_heap_used_mb'] for t in report), 2),
+            'tabs': report,
+        }
+
+    def status(self):
+        return {
+            'size': self.size,
+            'open': len(self.tabs),
+            'idle': self.idle.qsize(),
+            'replaced': self.replaced,
+            'opening': self.opening,
+            'browser_connected': self.browser is not None and self.browser.is_connected(),
+            'cdp': self.browser.stats() if self.browser is not None else None,
+            'tabs': [{'target_id': t.target_id, 'busy': t.busy, 'uses': t.uses} for t in self.tabs],
+        }
+
+
+async def ask(pool, text, on_delta):
+    """
+    借用一个标签页输入文本、点击发送，并把回复增量逐个交给 on_delta，回复结束后才归还标签页。
+    页面改写了已推送的内容时 on_delta 收到 ReplyReplace（完整回复），应替换而不是追加。
+    """
+    async with pool.tab() as tab:
+        client = tab.client
+        ready = (
+            await client.wait_for_selector(EDITOR_CSS_SELECTOR)
+            and await input_text_in_element(client, EDITOR_CSS_SELECTOR, text)
+            and await client.wait_for_element_enabled(SUBMIT_BUTTON_CSS_SELECTOR)
+        )
+        if not ready:
+            raise RuntimeError("输入文本失败")
+        # 先开始监听回复再点击发送，避免漏掉最早的增量
+        if REPLY_SOURCE == 'network':
+            reply = await client.watch_network_reply(CHAT_API_URL_PATTERN, REPLY_TIMEOUT)
+        else:
+            reply = await client.watch_reply(FEEDBACK_CSS_SELECTOR, REPLY_CSS_SELECTOR, REPLY_QUIET_SECONDS, REPLY_TIMEOUT)
+        if reply is None:
+            raise RuntimeError("未找到回复区域")
+        if not await click_element(client, SUBMIT_BUTTON_CSS_SELECTOR):
+            await reply.aclose()
+            raise RuntimeError("点击发送按钮失败")
+        async for delta in reply:
+            on_delta(delta)
+        return tab.target_id
+
+
+async def send_prompt(pool, text):
+    """提问并等待完整回复"""
+    started = time.monotonic()
+    parts = []
+
+    def collect(delta):
+        if isinstance(delta, ReplyReplace):
+            parts.clear()
+        parts.append(delta)
+
+    target_id = await ask(pool, text, collect)
+    return {
+        'success': True,
+        'text': ''.join(parts),
+        'target_id': target_id,
+        'elapsed': round(time.monotonic() - started, 3),
+    }
+
+
+def _log_write_error(future):
+    if future.exception() is not None:
+        logger.error(f"写入共享存储失败: {future.exception()}")
+
+
+async def stream_to_store(pool, generation_id, text):
+    """
+    提问并把回复增量写入共享存储，供 /stream 和 /ws 转发。
+    SQLite写入可能阻塞，全部交给单独的写入线程按顺序执行，不占用所有标签页共用的事件循环。
+    """
+    error = None
+
+    def on_delta(delta):
+        future = store_writer.submit(
+            store.append, generation_id, delta.replace('\n', '<br>'), isinstance(delta, ReplyReplace)
+        )
+        future.add_done_callback(_log_write_error)
+
+    try:
+        await ask(pool, text, on_delta)
+    except asyncio.TimeoutError:
+        error = "等待回复超时"
+    except Exception as e:
+        error = f"发生错误: {e}"
+        logger.error(error)
+    finally:
+        if error:
+            on_delta(f"<br>错误: {error}<br>")
+        # 排在所有增量之后执行，结束时内容已全部写入
+        await asyncio.get_running_loop().run_in_executor(store_writer, store.finish, generation_id, error)
+
+
+class BackgroundLoop:
+    """在后台线程中运行asyncio事件循环，供Flask的同步路由提交协程"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+app = Flask(__name__)
+# 回复增量保存在共享存储中，和其他代理一样通过 /stream 转发
+store = GenerationStore(os.environ.get('STATE_DB', 'browser_state.db'))
+# 共享存储的写入线程，只有一个线程以保证同一生成的增量按顺序写入
+store_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='store-writer')
+background = BackgroundLoop()
+pool = None
+pool_lock = threading.Lock()
+
+
+def get_pool():
+    """创建并缓存标签页池；一个标签页都打不开时不缓存，下次调用重新尝试"""
+    global pool
+    with pool_lock:
+        if pool is not None:
+            return pool
+        async def create():
+            new_pool = TabPool()
+            if not await new_pool.start():
+                await new_pool.close()
+                return None
+            return new_pool
+        new_pool = background.run(create())
+        if new_pool is None:
+            raise RuntimeError("无法打开标签页，请确认浏览器已用 --remote-debugging-port 启动")
+        pool = new_pool
+        return pool
+
+
+# 启动一次浏览器提问，返回生成id；标签页都在使用中时返回None
+def start_generation(user_text=None):
+    if not user_text:
+        user_text = DEFAULT_TEXT
+    current_pool = get_pool()
+    generation_id = store.try_start(user_text, max_running=current_pool.size)
+    if generation_id is not None:
+        asyncio.run_coroutine_threadsafe(stream_to_store(current_pool, generation_id, user_text), background.loop)
+    return generation_id
+
+
+@app.route('/')
+def index():
+    user_text = request.args.get('text')
+    use_websocket = websocket_enabled and request.args.get('transport') != 'sse'
+    generation_id = None
+    if not use_websocket:
+        try:
+            generation_id = start_generation(user_text)
+        except RuntimeError as e:
+            logger.error(f"启动提问失败: {e}")
+    with open('my.html', 'r', encoding='utf-8') as f:
+        html_template = f.read()
+    return render_template_string(html_template, websocket_enabled=use_websocket, generation_id=generation_id)
+
+
+@app.route('/stream')
+def stream():
+    generation_id = request.args.get('id', type=int)
+    # 回复被页面改写时发送 replace 事件，页面用它替换已显示的内容
+    return Response(event_stream(store, generation_id), content_type='text/event-stream')
+
+
+@app.route('/status')
+def status():
+    generation_id = request.args.get('id', type=int)
+    return {**store.status(generation_id), 'pool': pool.status() if pool is not None else None}
+
+
+@app.route('/translate')
+def translate():
+    text = request.args.get('text')
+    if not text:
+        return {'success': False, 'error': '缺少text参数'}, 400
+    try:
+        return background.run(send_prompt(get_pool(), text), REQUEST_TIMEOUT)
+    except Exception as e:
+        logger.error(f"处理请求失败: {e}")
+        return {'success': False, 'error': str(e)}, 503
+
+
+@app.route('/pool')
+def pool_status():
+    try:
+        return get_pool().status()
+    except RuntimeError as e:
+        return {'error': str(e)}, 503
+
+
+@app.route('/pool/metrics')
+def pool_metrics():
+    try:
+        current_pool = get_pool()
+    except RuntimeError as e:
+        return {'error': str(e)}, 503
+    return background.run(current_pool.metrics(), 30)
+
+
+websocket_enabled = register_websocket(app, store, start_generation)
+
+if __name__ == '__main__':
+    get_pool()
+    app.run(host='0.0.0.0', port=5001, threaded=True)
@@ -0,0 +1,168 @@
+# 腾讯元器凭据池：每个 token/assistant_id 组合一个令牌桶，请求调度到有余量的凭据上
+import logging
+import threading
+import time
+
+import requests
+
+import worker_mode
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialsExhausted(requests.exceptions.RequestException):
+    """排队等待超时仍没有可用凭据时抛出"""
+
+    # 配额问题与上游是否健康无关，hedged_lines 不计入熔断器
+    rate_limited = True
+
+
+class TokenBucket:
+    """令牌桶：按 rate 每秒补充，最多存 capacity 个"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        if now < self.blocked_until:
+            return 0.0
+        return self.tokens
+
+    def take(self, now):
+        if self.available(now) >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now):
+        # 距离下一个令牌可用还需要多久
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds, now):
+        # 被服务端限流时清空令牌并暂停一段时间
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class Credential:
+    def __init__(self, assistant_id, token, rate, capacity):
+        self.assistant_id = assistant_id
+        self.token = token
+        self.bucket = TokenBucket(rate, capacity)
+        self.requests = 0
+        self.rate_limited = 0
+
+    def status(self, now):
+        return {
+            'assistant_id': self.assistant_id,
+            'token': self.token[:4] + '***',
+            'tokens': round(self.bucket.available(now), 2),
+            'requests': self.requests,
+            'rate_limited': self.rate_limited,
+        }
+
+
+class CredentialPool:
+    """
+    凭据池。acquire() 选择当前令牌最多的凭据；全部耗尽时短暂排队，
+    超过 queue_timeout 仍无余量则返回 None。
+    令牌桶在每个进程中各有一份，多进程运行时每个工作进程只分到 rate_per_minute 和 burst 的 1/workers，
+    合计不超过配置的配额。
+    """
+
+    def __init__(self, rate_per_minute=60, burst=5, queue_timeout=10.0, workers=None):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.queue_timeout = queue_timeout
+        self.workers = workers or worker_mode.worker_count()
+        self.credentials = []
+        self.waiting = 0
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def configure(self, pairs, rate_per_minute=None, burst=None):
+        """按配置文件同步凭据列表，已存在的凭据保留令牌桶状态"""
+        with self.condition:
+            if rate_per_minute:
+                self.rate_per_minute = rate_per_minute
+            if burst:
+                self.burst = burst
+            # 本进程分到的配额；突发容量至少为1，否则永远取不到令牌
+            rate = self.rate_per_minute / 60.0 / self.workers
+            capacity = max(1, self.burst // self.workers)
+            existing = {(c.assistant_id, c.token): c for c in self.credentials}
+            credentials = []
+            for assistant_id, token in pairs:
+                credential = existing.get((assistant_id, token))
+                if credential is None:
+                    credential = Credential(assistant_id, token, rate, capacity)
+                credential.bucket.rate = rate
+                credential.bucket.capacity = capacity
+                credentials.append(credential)
+            self.credentials = credentials
+            self.condition.notify_all()
+
+    def acquire(self, timeout=None):
+        timeout = self.queue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if not self.credentials:
+                        return None
+                    best = max(self.credentials, key=lambda c: c.bucket.available(now))
+                    if best.bucket.take(now):
+                        best.requests += 1
+                        return best
+                    wait = min(c.bucket.wait_time(now) for c in self.credentials)
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return None
+                    logger.info(f"所有凭据暂无余量，排队等待 {min(wait, remaining):.2f} 秒")
+                    self.condition.wait(min(wait, remaining))
+            finally:
+                self.waiting -= 1
+
+    def acquire_or_raise(self, timeout=None):
+        credential = self.acquire(timeout)
+        if credential is None:
+            raise CredentialsExhausted("所有凭据均已达到速率限制，请稍后再试")
+        return credential
+
+    def report_rate_limited(self, credential, retry_after=None):
+        """上游返回429时调用，暂停该凭据 Retry-After 秒（默认60秒）"""
+        try:
+            seconds = float(retry_after) if retry_after else 60.0
+        except ValueError:
+            seconds = 60.0
+        with self.condition:
+            credential.rate_limited += 1
+            credential.bucket.block(seconds, time.monotonic())
+            self.condition.notify_all()
+        logger.warning(f"凭据 {credential.assistant_id} 被限流，暂停 {seconds} 秒")
+
+    def status(self):
+        with self.condition:
+            now = time.monotonic()
+            return {
+                'rate_per_minute': self.rate_per_minute,
+                'burst': self.burst,
+                'workers': self.workers,
+                'waiting': self.waiting,
+                'credentials': [c.status(now) for c in self.credentials],
+            }
@@ -0,0 +1,129 @@
+# 统一网关：一个进程同时代理腾讯元器和Ollama，共用HTTP连接池、生成状态库、调度、SSE/WebSocket推送和trace
+# 用法: python gateway.py，访问 http://localhost:5000/?text=你的问题&backend=ollama
+# backend 可选 hunyuan、ollama、auto（默认，选择健康且空闲并发最多的后端）
+# connAgent.py 和 local-lama.py 仍可单独运行
+import os
+import logging
+from threading import Thread
+
+from flask import Flask, render_template_string, Response, request
+
+from backends import create_session, run_generation, HunyuanBackend, OllamaBackend
+from push_channel import event_stream, register_websocket
+from generation_store import GenerationStore
+from tracing import Tracer, register_trace_routes
+import worker_mode
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+# Ollama服务器列表，第一个为主服务器，其余为首token超时时的对冲备用服务器
+OLLAMA_SERVERS = ['172.27.22.133']
+OLLAMA_MODEL = 'english-expert:latest'
+# 每个后端同时进行的生成数上限
+HUNYUAN_MAX_RUNNING = 2
+OLLAMA_MAX_RUNNING = 1
+# 共用连接池大小
+HTTP_POOL_SIZE = 32
+
+# 生成状态和流式响应内容保存在共享存储中，按后端分别统计进行中的生成
+store = GenerationStore(os.environ.get('STATE_DB', 'gateway_state.db'))
+# 最近请求的分阶段耗时，/debug/trace 查看
+tracer = Tracer()
+
+session = create_session(HTTP_POOL_SIZE)
+backends = {
+    'hunyuan': HunyuanBackend(session, max_running=HUNYUAN_MAX_RUNNING),
+    'ollama': OllamaBackend(session, OLLAMA_SERVERS, OLLAMA_MODEL, max_running=OLLAMA_MAX_RUNNING),
+}
+
+
+def free_slots(backend):
+    return backend.max_running - store.running(backend.name)
+
+
+# WebSocket提交按后端分别排队，一个后端繁忙时不影响另一个后端的提交；auto 单独排队，每次轮询重新选择后端
+def waiting_line_for(options):
+    name = options.get('backend') or 'auto'
+    if name != 'auto' and name not in backends:
+        raise ValueError(f"未知的后端: {name}，可选 {', '.join(backends)} 或 auto")
+    return name
+
+
+# 选择后端：指定名称时直接使用；auto 时在健康的后端中选空闲并发最多的，都不健康时退回全部后端
+def choose_backend(name=None):
+    if name and name != 'auto':
+        return backends.get(name)
+    candidates = [b for b in backends.values() if b.healthy()] or list(backends.values())
+    return max(candidates, key=free_slots)
+
+
+# 启动流式响应线程，返回生成id；所选后端并发已满或后端名称无效时返回None
+# options 中的 backend 用于选择后端，其余参数传给后端（如Ollama的num_ctx、temperature）
+def start_generation(user_text, options=None):
+    options = dict(options or {})
+    backend = choose_backend(options.pop('backend', None))
+    if backend is None:
+        return None
+    generation_id = store.try_start(user_text, backend.max_running, backend=backend.name)
+    if generation_id is not None:
+        trace = tracer.start(backend.name, key=generation_id, prompt_length=len(user_text or ''))
+        Thread(target=run_generation, args=(backend, store, generation_id, user_text, options, trace)).start()
+    return generation_id
+
+
+# 主页面路由，页面把 text 以外的查询参数（包括 backend）作为options提交
+@app.route('/')
+def index():
+    user_text = request.args.get('text')
+    # 启用WebSocket时由页面通过/ws提交文本，回退到SSE时带 transport=sse 参数
+    use_websocket = websocket_enabled and request.args.get('transport') != 'sse'
+
+    generation_id = None
+    if user_text and not use_websocket:
+        options = {k: v for k, v in request.args.items() if k not in ('text', 'transport')}
+        try:
+            waiting_line_for(options)
+        except ValueError as e:
+            # 不渲染页面，否则页面会追读最新一个生成，把别人的回复当成这次的回答
+            logger.warning(str(e))
+            return f"错误: {e}", 400
+        generation_id = start_generation(user_text, options)
+        if generation_id is None:
+            logger.warning("所选后端正在处理其他请求，忽略新请求")
+
+    with open('ollama_web.html', 'r', encoding='utf-8') as f:
+        html_template = f.read()
+    return render_template_string(html_template, websocket_enabled=use_websocket, generation_id=generation_id)
+
+
+# 流式响应路由
+@app.route('/stream')
+def stream():
+    generation_id = request.args.get('id', type=int)
+    return Response(event_stream(store, generation_id, tracer), mimetype="text/event-stream")
+
+
+# 状态检查路由：生成状态以及每个后端的健康、空闲并发、上游和凭据状态
+@app.route('/status')
+def status():
+    generation_id = request.args.get('id', type=int)
+    return {
+        **store.status(generation_id),
+        'backends': {name: {**b.status(), 'free_slots': free_slots(b)} for name, b in backends.items()}
+    }
+
+
+# WebSocket推送通道
+websocket_enabled = register_websocket(app, store, start_generation, tracer=tracer, waiting_line_for=waiting_line_for)
+# 分阶段耗时查看：/debug/trace，?format=chrome 导出Chrome trace-event JSON
+register_trace_routes(app, tracer)
+
+if __name__ == '__main__':
+    logger.info("启动统一网关...")
+    logger.info("访问 http://localhost:5000/?text=你的问题&backend=hunyuan|ollama|auto")
+    logger.info("设置环境变量 WORKERS=N 可以多进程方式运行")
+    worker_mode.run(app, host='0.0.0.0', port=5000)
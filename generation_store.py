@@ -0,0 +1,317 @@
+# 生成状态共享存储：生成记录和token流保存在SQLite中，多个工作进程可以互相读取
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+# 已完成的生成保留多久（秒），超过后从库中淘汰
+RETAIN_SECONDS = float(os.environ.get('RETAIN_SECONDS', 3600))
+# 库中保留的已完成生成内容总量上限（UTF-8字节数，包括被替换掉的内容），超过时从最早完成的开始淘汰
+RETAIN_MAX_BYTES = int(os.environ.get('RETAIN_MAX_BYTES', 8 * 1024 * 1024))
+# 设置后被淘汰的生成先以JSON转存到该目录（文件名含生成id），之后仍可按id读取；库中的记录照常删除
+SPILL_DIR = os.environ.get('SPILL_DIR') or None
+
+
+def join_chunks(chunks):
+    """按顺序拼接 (content, replace) 序列，replace 的内容替换之前拼接的全部内容"""
+    parts = []
+    for content, replace in chunks:
+        if replace:
+            parts.clear()
+        parts.append(content)
+    return ''.join(parts)
+
+
+class GenerationStore:
+    """
+    用SQLite保存生成状态，替代模块级的 full_response / response_queue / is_receiving。
+    同一时间处于 running 状态的生成数量有上限（默认1个）；任意进程都可以按 seq 追读token。
+    已完成的生成在 finish() 时按保留时间和内容总量淘汰，淘汰后库中不留记录，长期运行时库的大小保持稳定。
+    """
+
+    def __init__(self, path, stale_after=180.0, retain_seconds=None, max_bytes=None, spill_dir=None):
+        self.path = path
+        # running 状态超过这么久没有写入则视为所在进程已退出
+        self.stale_after = stale_after
+        self.retain_seconds = RETAIN_SECONDS if retain_seconds is None else retain_seconds
+        self.max_bytes = RETAIN_MAX_BYTES if max_bytes is None else max_bytes
+        self.spill_dir = spill_dir or SPILL_DIR
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        self.local = threading.local()
+        conn = self._connect()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS generations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                prompt TEXT,
+                backend TEXT,
+                status TEXT NOT NULL,
+                error TEXT,
+                length INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                finished REAL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                generation_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                reset INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (generation_id, seq)
+            );
+        ''')
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _conn(self):
+        # 每个线程一个连接；fork出的子进程不能复用父进程的连接
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.conn = self._connect()
+            self.local.pid = os.getpid()
+            self.local.next_seq = {}
+        return self.local.conn
+
+    def _expire_stale(self, conn, now):
+        conn.execute(
+            "UPDATE generations SET status = ?, error = ?, finished = ? WHERE status = ? AND updated < ?",
+            (ERROR, '生成进程已退出', now, RUNNING, now - self.stale_after)
+        )
+
+    def _count_running(self, conn, backend=None):
+        if backend is None:
+            return conn.execute("SELECT COUNT(*) FROM generations WHERE status = ?", (RUNNING,)).fetchone()[0]
+        return conn.execute(
+            "SELECT COUNT(*) FROM generations WHERE status = ? AND backend = ?", (RUNNING, backend)
+        ).fetchone()[0]
+
+    def try_start(self, prompt, max_running=1, backend=None):
+        """
+        进行中的生成少于 max_running 个时创建一条新记录并返回id，否则返回None。
+        指定 backend 时只统计该后端进行中的生成。
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._expire_stale(conn, now)
+            if self._count_running(conn, backend) >= max_running:
+                conn.execute('COMMIT')
+                return None
+            cursor = conn.execute(
+                "INSERT INTO generations (prompt, backend, status, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (prompt, backend, RUNNING, now, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.local.next_seq[cursor.lastrowid] = 0
+        return cursor.lastrowid
+
+    def append(self, generation_id, content, replace=False):
+        """追加内容；replace=True 表示 content 是完整内容，替换之前追加的全部内容"""
+        conn = self._conn()
+        seq = self.local.next_seq.get(generation_id)
+        if seq is None:
+            row = conn.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM chunks WHERE generation_id = ?", (generation_id,)
+            ).fetchone()
+            seq = row[0]
+        self.local.next_seq[generation_id] = seq + 1
+        conn.execute('BEGIN')
+        try:
+            conn.execute(
+                "INSERT INTO chunks (generation_id, seq, content, reset) VALUES (?, ?, ?, ?)",
+                (generation_id, seq, content, 1 if replace else 0)
+            )
+            conn.execute(
+                "UPDATE generations SET length = ? + CASE WHEN ? THEN 0 ELSE length END, bytes = bytes + ?, "
+                "updated = ? WHERE id = ?",
+                (len(content), replace, len(content.encode('utf-8')), time.time(), generation_id)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            # 下次追加时重新从库中读取 seq
+            self.local.next_seq.pop(generation_id, None)
+            raise
+
+    def finish(self, generation_id, error=None):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE generations SET status = ?, error = ?, updated = ?, finished = ? WHERE id = ?",
+            (ERROR if error else DONE, error, now, now, generation_id)
+        )
+        self.local.next_seq.pop(generation_id, None)
+        try:
+            # 刚结束的生成不淘汰，稍后打开 /stream?id= 的页面仍能读到
+            self.prune(now, keep_id=generation_id)
+        except Exception as e:
+            logger.warning(f"淘汰已完成的生成时出错: {e}")
+
+    def prune(self, now=None, keep_id=None):
+        """
+        淘汰已完成的生成：完成超过 retain_seconds 的，以及按完成时间从新到旧累计超过 max_bytes 之后的。
+        keep_id 指定的生成不淘汰，但计入总量。设置了 spill_dir 时内容先转存到磁盘，记录和内容都从库中删除。
+        返回淘汰的数量。
+        """
+        conn = self._conn()
+        now = time.time() if now is None else now
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT * FROM generations WHERE status != ? ORDER BY finished DESC, id DESC", (RUNNING,)
+            ).fetchall()
+            victims = []
+            kept = 0
+            for row in rows:
+                if row['id'] == keep_id:
+                    kept += row['bytes']
+                elif victims or (row['finished'] or 0) < now - self.retain_seconds or kept + row['bytes'] > self.max_bytes:
+                    # 比已淘汰的更早完成的一律淘汰
+                    victims.append(row)
+                else:
+                    kept += row['bytes']
+            for row in victims:
+                if self.spill_dir:
+                    self._spill(conn, row)
+                conn.execute("DELETE FROM chunks WHERE generation_id = ?", (row['id'],))
+                conn.execute("DELETE FROM generations WHERE id = ?", (row['id'],))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if victims:
+            logger.info(f"淘汰 {len(victims)} 个已完成的生成，保留内容 {kept} 字节")
+        return len(victims)
+
+    def _spill(self, conn, row):
+        chunks = conn.execute(
+            "SELECT content, reset FROM chunks WHERE generation_id = ? ORDER BY seq", (row['id'],)
+        ).fetchall()
+        transcript = {key: row[key] for key in ('id', 'prompt', 'backend', 'status', 'error', 'created', 'finished')}
+        transcript['text'] = join_chunks((chunk['content'], chunk['reset']) for chunk in chunks)
+        with open(self._spill_path(row['id']), 'w', encoding='utf-8') as f:
+            json.dump(transcript, f, ensure_ascii=False)
+
+    def _spill_path(self, generation_id):
+        return os.path.join(self.spill_dir, f"generation-{generation_id}.json")
+
+    def _read_spilled(self, generation_id):
+        if not self.spill_dir or not os.path.exists(self._spill_path(generation_id)):
+            return None
+        try:
+            with open(self._spill_path(generation_id), 'r', encoding='utf-8') as f:
+                return json.load(f)['text']
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"读取转存的生成 {generation_id} 失败: {e}")
+            return None
+
+    def get(self, generation_id):
+        row = self._conn().execute("SELECT * FROM generations WHERE id = ?", (generation_id,)).fetchone()
+        return dict(row) if row else None
+
+    def latest(self):
+        row = self._conn().execute("SELECT * FROM generations ORDER BY id DESC LIMIT 1").fetchone()
+        return dict(row) if row else None
+
+    def running(self, backend=None):
+        """进行中的生成数量，指定 backend 时只统计该后端"""
+        conn = self._conn()
+        self._expire_stale(conn, time.time())
+        return self._count_running(conn, backend)
+
+    def is_receiving(self):
+        conn = self._conn()
+        self._expire_stale(conn, time.time())
+        return conn.execute("SELECT 1 FROM generations WHERE status = ?", (RUNNING,)).fetchone() is not None
+
+    def read(self, generation_id, after_seq=-1):
+        """
+        读取 seq 大于 after_seq 的内容，返回 [(seq, content, replace), ...]；
+        已转存到磁盘的生成从头读取时整体作为 seq 0 返回。
+        """
+        rows = self._conn().execute(
+            "SELECT seq, content, reset FROM chunks WHERE generation_id = ? AND seq > ? ORDER BY seq",
+            (generation_id, after_seq)
+        ).fetchall()
+        if not rows and after_seq < 0:
+            text = self._read_spilled(generation_id)
+            if text is not None:
+                return [(0, text, False)]
+        return [(row['seq'], row['content'], bool(row['reset'])) for row in rows]
+
+    def full_text(self, generation_id):
+        return join_chunks((content, replace) for _, content, replace in self.read(generation_id))
+
+    def follow(self, generation_id=None, poll_interval=0.05, events=False):
+        """
+        从头追读一个生成（默认最新一个）的内容，生成结束且读完后返回。
+        events=True 时产出 (content, replace)，接收方遇到 replace 时应替换已收到的内容；
+        否则只产出 content，适用于只追加内容的后端。
+        """
+        if generation_id is None:
+            latest = self.latest()
+            if latest is None:
+                return
+            generation_id = latest['id']
+        last_seq = -1
+        while True:
+            # 先看状态再读内容，结束前写入的内容一定能读到
+            generation = self.get(generation_id)
+            chunks = self.read(generation_id, last_seq)
+            for seq, content, replace in chunks:
+                last_seq = seq
+                yield (content, replace) if events else content
+            if generation is None or generation['status'] != RUNNING:
+                return
+            if generation['updated'] < time.time() - self.stale_after:
+                logger.warning(f"生成 {generation_id} 长时间没有更新，停止追读")
+                return
+            if not chunks:
+                time.sleep(poll_interval)
+
+    def status(self, generation_id=None):
+        """指定id时返回该生成的状态，否则返回整体状态和最新一个生成的长度"""
+        if generation_id is not None:
+            generation = self.get(generation_id)
+            return {
+                'is_receiving': generation is not None and generation['status'] == RUNNING,
+                'response_length': generation['length'] if generation else 0,
+                'generation_id': generation_id,
+            }
+        latest = self.latest()
+        return {
+            'is_receiving': self.is_receiving(),
+            'response_length': latest['length'] if latest else 0,
+            'generation_id': latest['id'] if latest else None,
+            'retention': self.retention(),
+        }
+
+    def retention(self):
+        """库中保留的生成数量和内容总字节数，以及淘汰设置"""
+        row = self._conn().execute(
+            "SELECT COUNT(*) AS generations, COALESCE(SUM(bytes), 0) AS bytes FROM generations"
+        ).fetchone()
+        return {
+            'generations': row['generations'],
+            'bytes': row['bytes'],
+            'retain_seconds': self.retain_seconds,
+            'max_bytes': self.max_bytes,
+            'spill_dir': self.spill_dir,
+        }
@@ -1,11 +1,14 @@
 # f:\code\腾讯元器智能体get代理\local-lama.py - 真正可用的Ollama版本
-import requests
-import json
-import time
+import os
 import logging
 from flask import Flask, render_template_string, Response, request
 from threading import Thread
-from queue import Queue
+from backends import create_session, run_generation, OllamaBackend
+from push_channel import event_stream, register_websocket
+from generation_store import GenerationStore
+from semantic_cache import SemanticCache, np
+from tracing import Tracer, register_trace_routes
+import worker_mode
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -13,164 +16,65 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# 全局变量
-response_queue = Queue()
-full_response = ""
-is_receiving = False
+# Ollama服务器列表，第一个为主服务器，其余为首token超时时的对冲备用服务器
+OLLAMA_SERVERS = ['172.27.22.133']
+OLLAMA_MODEL = 'english-expert:latest'  # 你可以修改为其他模型名称
+session = create_session()
 
-def update_response(content):
-    global full_response
-    full_response += content
-    response_queue.put(content)
-    logger.info(f"添加响应: {content[:50]}...")
+# 语义近似缓存：设置 SEMANTIC_CACHE=1 并安装numpy后启用，只差标点或个别用词的提示直接返回缓存的回答
+SEMANTIC_CACHE = os.environ.get('SEMANTIC_CACHE') == '1'
+# 计算提示向量使用的Ollama embedding模型
+EMBED_MODEL = 'nomic-embed-text'
+# 相似度达到该值视为命中；介于两个阈值之间的记为近似未命中，用于调整阈值
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_NEAR_MISS = 0.85
+# 最多缓存的条目数，超过后淘汰最久未使用的
+SEMANTIC_CACHE_SIZE = 1000
 
-# Ollama API流式响应函数 - 修复版本
-def stream_response_from_api(user_text=None):
-    global is_receiving
-    is_receiving = True
-    logger.info("开始接收Ollama API响应...")
-    update_response("开始接收Ollama API响应...<br>")
-    
-    # Ollama API配置
-    server_ip = '172.27.22.133'  # 修改为你的Ollama服务器IP地址
-    # server_ip = 'http://127.0.0.1
-    url = f'http://{server_ip}:11434/api/generate'
-    
-    # 默认文本
-    default_text = "Hello, how are you?"
-    mytext = user_text if user_text else default_text
-    
-    # 请求数据 - 使用你的模型
-    data = {
-        "model": "english-expert:latest",  # 你可以修改为其他模型名称
-        "prompt": mytext,
-        "stream": True
-    }
-    
-    logger.info(f"发送请求到Ollama，模型: {data['model']}, 文本: {mytext[:50]}...")
-    update_response(f"使用模型: {data['model']}<br>")
-    
-    try:
-        # 首先检查Ollama服务是否可用
-        try:
-            check_url = f'http://{server_ip}:11434/api/tags'
-            check_response = requests.get(check_url, timeout=5)
-            if check_response.status_code == 200:
-                models = check_response.json().get('models', [])
-                model_names = [model.get('name', '') for model in models]
-                logger.info(f"可用模型: {model_names}")
-                
-                # 检查指定模型是否存在
-                if data['model'] not in model_names:
-                    available_models = ', '.join(model_names)
-                    error_msg = f"模型 '{data['model']}' 不存在。可用模型: {available_models}"
-                    logger.error(error_msg)
-                    update_response(f"错误: {error_msg}<br>")
-                    is_receiving = False
-                    return
-            else:
-                logger.warning(f"无法获取模型列表，状态码: {check_response.status_code}")
-        except Exception as e:
-            logger.warning(f"检查Ollama服务时出错: {e}")
-            update_response(f"警告: 无法检查Ollama服务状态: {e}<br>")
-        
-        # 发送流式请求
-        with requests.post(url, json=data, stream=True, timeout=120) as response:
-            response.raise_for_status()
-            logger.info(f"Ollama响应状态码: {response.status_code}")
-            update_response("正在接收流式响应...<br>")
-            
-            # 处理流式响应
-            chunk_count = 0
-            for line in response.iter_lines():
-                if line:
-                    chunk_count += 1
-                    
-                    try:
-                        chunk_str = line.decode('utf-8').strip()
-                        logger.debug(f"收到chunk {chunk_count}: {chunk_str[:100]}...")
-                        
-                        # 解析JSON响应
-                        chunk_data = json.loads(chunk_str)
-                        
-                        # 提取响应内容
-                        if 'response' in chunk_data:
-                            content = chunk_data['response']
-                            if content:
-                                # 处理换行符
-                                content_display = content.replace('\n', '<br>')
-                                update_response(content_display)
-                        
-                        # 检查是否完成
-                        if chunk_data.get('done', False):
-                            logger.info("响应生成完成")
-                            update_response("<br>响应生成完成<br>")
-                            break
-                            
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"JSON解析错误: {e}, 原始数据: {chunk_str[:100]}...")
-                        # 如果不是有效的JSON，可能是原始文本
-                        update_response(f"[原始数据: {chunk_str[:100]}...]<br>")
-                    except Exception as e:
-                        logger.error(f"处理chunk时出错: {e}")
-                        update_response(f"[处理错误: {e}]<br>")
-            
-            if chunk_count == 0:
-                logger.warning("未收到任何有效响应数据")
-                update_response("<br>警告: 未收到任何有效响应数据<br>")
-            else:
-                update_response(f"<br>流式响应接收完成，共处理 {chunk_count} 个数据块<br>")
-                
-    except requests.exceptions.Timeout as e:
-        error_msg = f"请求超时 (120秒): {e}"
-        logger.error(error_msg)
-        update_response(f"<br>错误: {error_msg}<br>")
-        
-    except requests.exceptions.ConnectionError as e:
-        error_msg = f"连接错误: 无法连接到Ollama服务 (127.0.0.1:11434)。请确保Ollama正在运行: {e}"
-        logger.error(error_msg)
-        update_response(f"<br>错误: {error_msg}<br>")
-        
-    except requests.exceptions.RequestException as e:
-        error_msg = f"请求出错: {e}"
-        logger.error(error_msg)
-        update_response(f"<br>错误: {error_msg}<br>")
-        
-    except Exception as e:
-        error_msg = f"发生错误: {e}"
-        logger.error(error_msg, exc_info=True)
-        update_response(f"<br>错误: {error_msg}<br>")
-    finally:
-        is_receiving = False
-        logger.info("Ollama流式响应处理结束")
+# 生成状态和流式响应内容保存在共享存储中，多个工作进程都能读取
+store = GenerationStore(os.environ.get('STATE_DB', 'ollama_state.db'))
+# 最近请求的分阶段耗时，/debug/trace 查看
+tracer = Tracer()
 
-# 生成事件流 - 修复版本
-def event_stream():
-    try:
-        while True:
-            if not response_queue.empty():
-                content = response_queue.get(timeout=0.1)
-                yield f"data: {content}\n\n"
-            elif not is_receiving:
-                # 确保队列清空后再结束
-                if response_queue.empty():
-                    break
-            else:
-                time.sleep(0.1)
-    except:
-        pass
+# 通过Ollama的embedding接口批量计算向量
+def embed_texts(texts):
+    url = f'http://{OLLAMA_SERVERS[0]}:11434/api/embed'
+    response = session.post(url, json={"model": EMBED_MODEL, "input": texts}, timeout=10)
+    response.raise_for_status()
+    return response.json()['embeddings']
+
+semantic_cache = None
+if SEMANTIC_CACHE:
+    if np is None:
+        logger.warning("未安装numpy，语义缓存不启用")
+    else:
+        semantic_cache = SemanticCache(embed_texts, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_NEAR_MISS, SEMANTIC_CACHE_SIZE)
+
+# Ollama后端：请求构造、options透传、语义缓存和上游状态（首token截止时间、熔断器）跨请求保留
+backend = OllamaBackend(session, OLLAMA_SERVERS, OLLAMA_MODEL, max_running=1, semantic_cache=semantic_cache)
+
+# 启动流式响应线程，返回生成id；已有生成在进行时返回None
+def start_generation(user_text, options=None):
+    generation_id = store.try_start(user_text, backend.max_running)
+    if generation_id is not None:
+        trace = tracer.start(backend.name, key=generation_id, prompt_length=len(user_text or ''))
+        thread = Thread(target=run_generation, args=(backend, store, generation_id, user_text, options, trace))
+        thread.start()
+    return generation_id
 
 # 主页面路由 - 修复版本
 @app.route('/')
 def index():
     user_text = request.args.get('text')
+    # 启用WebSocket时由页面通过/ws提交文本，回退到SSE时带 transport=sse 参数
+    use_websocket = websocket_enabled and request.args.get('transport') != 'sse'
     
     # 检查是否有用户文本
-    if user_text:
-        if not is_receiving:
+    generation_id = None
+    if user_text and not use_websocket:
+        generation_id = start_generation(user_text, request.args)
+        if generation_id is not None:
             logger.info(f"收到用户请求: {user_text[:50]}...")
-            thread = Thread(target=stream_response_from_api, args=(user_text,))
-            thread.start()
         else:
             logger.warning("正在处理其他请求，忽略新请求")
     
@@ -178,7 +82,7 @@ def index():
     try:
         with open('ollama_web.html', 'r', encoding='utf-8') as f:
             html_template = f.read()
-        return render_template_string(html_template)
+        return render_template_string(html_template, websocket_enabled=use_websocket, generation_id=generation_id)
     except Exception as e:
         logger.error(f"读取HTML模板失败: {e}")
         return f"<h1>Ollama Web界面加载失败: {e}</h1>"
@@ -186,16 +90,26 @@ def index():
 # 流式响应路由
 @app.route('/stream')
 def stream():
-    return Response(event_stream(), mimetype="text/event-stream")
+    generation_id = request.args.get('id', type=int)
+    return Response(event_stream(store, generation_id, tracer), mimetype="text/event-stream")
 
 # 状态检查路由
 @app.route('/status')
 def status():
+    generation_id = request.args.get('id', type=int)
     return {
-        'is_receiving': is_receiving,
-        'response_length': len(full_response)
+        **store.status(generation_id),
+        **backend.status(),
+        'semantic_cache': semantic_cache.stats() if semantic_cache is not None else None
     }
 
+# 语义缓存统计（命中、近似未命中、淘汰等）
+@app.route('/cache')
+def cache_status():
+    if semantic_cache is None:
+        return {'enabled': False}
+    return {'enabled': True, **semantic_cache.stats()}
+
 # 输入界面路由
 @app.route('/input')
 def input_form():
@@ -338,10 +252,16 @@ def input_form():
         <p>请直接访问: <a href="/?text=hello">测试链接</a></p>
         """
 
+# WebSocket推送通道
+websocket_enabled = register_websocket(app, store, start_generation, tracer=tracer)
+# 分阶段耗时查看：/debug/trace，?format=chrome 导出Chrome trace-event JSON
+register_trace_routes(app, tracer)
+
 if __name__ == '__main__':
     logger.info("启动Ollama流式响应服务器...")
     logger.info("访问 http://localhost:5000/input 使用输入界面")
     logger.info("或直接访问 http://localhost:5000/?text=你的问题")
     logger.info("确保Ollama服务正在运行: ollama serve")
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    logger.info("设置环境变量 WORKERS=N 可以多进程方式运行")
+    worker_mode.run(app, host='0.0.0.0', port=5000)
 
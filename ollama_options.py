@@ -0,0 +1,67 @@
+# Ollama options 的解析和 num_ctx 自动选择，local-lama.py 和网关的Ollama后端共用
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 允许通过查询参数透传给Ollama的options及其类型
+OLLAMA_OPTION_TYPES = {
+    'num_predict': int,
+    'num_ctx': int,
+    'num_thread': int,
+    'num_gpu': int,
+    'num_batch': int,
+    'num_keep': int,
+    'temperature': float,
+    'top_k': int,
+    'top_p': float,
+    'min_p': float,
+    'repeat_penalty': float,
+    'repeat_last_n': int,
+    'seed': int,
+}
+# 传 num_ctx=auto 时按提示长度自动选择；不传时不发送num_ctx，使用模型Modelfile中的设置。
+# 默认不自动选择：num_ctx 与已加载的不同时Ollama会重新加载模型，长短不一的请求会反复重新加载
+# 自动选择的下限取Ollama的默认值，只在提示较长时放大
+AUTO_NUM_CTX_MIN = 2048
+AUTO_NUM_CTX_MAX = 8192
+# 模型模板和系统提示占用的token估计值，Modelfile中的系统提示较长时需要相应调大
+PROMPT_OVERHEAD_TOKENS = 256
+# 未指定num_predict时为回答预留的token数
+DEFAULT_REPLY_TOKENS = 512
+
+# 从查询参数（或WebSocket提交的options）中解析Ollama options
+def parse_ollama_options(args):
+    options = {}
+    for name, cast in OLLAMA_OPTION_TYPES.items():
+        value = args.get(name)
+        if value is None or value == '':
+            continue
+        if name == 'num_ctx' and value == 'auto':
+            options[name] = 'auto'
+            continue
+        try:
+            options[name] = cast(value)
+        except (TypeError, ValueError):
+            logger.warning(f"忽略无效的参数 {name}={value}")
+    return options
+
+# 粗略估计提示的token数：中日韩字符约1字1个token，其余约4个字符1个token
+def estimate_prompt_tokens(text):
+    cjk = sum(1 for ch in text if '\u3000' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+# 按提示长度和回答预留量选择num_ctx，按2的幂取整，减少num_ctx变化导致的模型重新加载
+def auto_num_ctx(prompt, num_predict=None):
+    reply_tokens = num_predict if num_predict and num_predict > 0 else DEFAULT_REPLY_TOKENS
+    needed = estimate_prompt_tokens(prompt) + PROMPT_OVERHEAD_TOKENS + reply_tokens
+    num_ctx = AUTO_NUM_CTX_MIN
+    while num_ctx < needed and num_ctx < AUTO_NUM_CTX_MAX:
+        num_ctx *= 2
+    return num_ctx
+
+# 透传的options中num_ctx为auto时按提示长度自动选择，返回新的dict
+def apply_num_ctx(prompt, options):
+    options = dict(options or {})
+    if options.get('num_ctx') == 'auto':
+        options['num_ctx'] = auto_num_ctx(prompt, options.get('num_predict'))
+    return options
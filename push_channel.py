@@ -0,0 +1,175 @@
+# WebSocket推送通道：一个连接承载提交、token流、排队位置和完成/错误事件
+# 依赖 flask-sock（pip install flask-sock），未安装时页面自动回退到SSE，SSE事件流由 event_stream 生成
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
+logger = logging.getLogger(__name__)
+
+# 服务端定时发送ping的间隔（秒），排队中的连接断开后能及时发现并离开队列
+PING_INTERVAL = 20
+
+
+def event_stream(store, generation_id=None, tracer=None):
+    """
+    /stream 路由的SSE事件流：从共享存储追读一个生成（默认最新一个），生成结束且内容读完后关闭。
+    内容被替换时发送 replace 事件。传入 tracer 时把推送耗时记到对应生成的trace上。
+    """
+    if generation_id is None:
+        latest = store.latest()
+        generation_id = latest['id'] if latest else None
+    trace = tracer.get(generation_id) if tracer is not None else None
+    started = time.perf_counter()
+    first_sent = None
+    for content, replace in store.follow(generation_id, events=True):
+        if trace is not None and first_sent is None:
+            first_sent = time.perf_counter()
+            trace.add('sse_first_chunk', started, first_sent)
+        # yield 挂起的时间即写出到客户端的时间
+        flush_started = time.perf_counter()
+        if replace:
+            yield f"event: replace\ndata: {content}\n\n"
+        else:
+            yield f"data: {content}\n\n"
+        if trace is not None:
+            trace.count('sse_flush', time.perf_counter() - flush_started)
+    if trace is not None:
+        trace.add('sse', started)
+
+
+class WaitingLine:
+    """等待开始生成的WebSocket提交，按先来后到排队"""
+
+    def __init__(self):
+        self.tickets = deque()
+        self.next_ticket = 0
+        self.lock = threading.Lock()
+        # 排在最前的提交上次尝试启动时，这个队列对应的后端是否已满
+        self.backend_full = False
+
+    def join(self):
+        with self.lock:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.tickets.append(ticket)
+            return ticket
+
+    def position(self, ticket):
+        with self.lock:
+            return self.tickets.index(ticket)
+
+    def leave(self, ticket):
+        with self.lock:
+            if ticket in self.tickets:
+                self.tickets.remove(ticket)
+
+
+def register_websocket(app, store, start_generation, poll_interval=0.5, tracer=None, waiting_line_for=None):
+    """
+    在 app 上注册 /ws 路由，返回是否启用成功。
+    store 为 GenerationStore；start_generation(text) 启动生成并返回生成id，已有生成进行中时返回None。
+    传入 tracer 时把排队等待和推送耗时记到对应生成的trace上。
+    waiting_line_for(options) 返回提交所排的队列名，不同队列互不等待；提交无效时抛出 ValueError，
+    客户端立即收到 error。默认所有提交排在同一个队列中。
+    客户端消息: {"type": "submit", "text": ..., "options": {...}} 或 {"type": "watch"}
+    服务端消息: queue / start / token / replace / done / error，replace 表示用 data 替换已收到的全部内容
+    """
+    if Sock is None:
+        logger.info("未安装 flask-sock，WebSocket通道不可用，页面将使用SSE")
+        return False
+
+    app.config.setdefault('SOCK_SERVER_OPTIONS', {'ping_interval': PING_INTERVAL})
+    sock = Sock(app)
+    waiting_lines = {}
+    waiting_lines_lock = threading.Lock()
+
+    def get_waiting_line(name):
+        with waiting_lines_lock:
+            return waiting_lines.setdefault(name, WaitingLine())
+
+    def send(ws, message_type, **fields):
+        fields['type'] = message_type
+        ws.send(json.dumps(fields, ensure_ascii=False))
+
+    @sock.route('/ws')
+    def websocket(ws):
+        try:
+            message = json.loads(ws.receive())
+        except (TypeError, ValueError):
+            send(ws, 'error', message='无效的消息格式')
+            return
+
+        generation_id = None
+        submitted = time.perf_counter()
+        if message.get('type') == 'submit':
+            try:
+                line_name = waiting_line_for(message.get('options') or {}) if waiting_line_for else None
+            except ValueError as e:
+                send(ws, 'error', message=str(e))
+                return
+            waiting_line = get_waiting_line(line_name)
+            ticket = waiting_line.join()
+            try:
+                # 轮到自己时尝试启动，启动不了时推送排队位置
+                last_position = None
+                while True:
+                    # 客户端已断开时离开队列，不为没有人接收的提交启动生成
+                    if not ws.connected:
+                        logger.info("排队中的WebSocket连接已断开，放弃提交")
+                        return
+                    position = waiting_line.position(ticket)
+                    if position == 0:
+                        # 附带options时一并传给后端（如Ollama的num_ctx、temperature）
+                        args = (message.get('text'),)
+                        if message.get('options'):
+                            args += (message['options'],)
+                        try:
+                            generation_id = start_generation(*args)
+                        except RuntimeError as e:
+                            # 后端暂时不可用（如浏览器未启动），告知客户端而不是一直排队
+                            send(ws, 'error', message=str(e))
+                            return
+                        waiting_line.backend_full = generation_id is None
+                        if generation_id is not None:
+                            break
+                    # 位置为前面排队的提交数，本队列的后端已满时再加上要先结束的那个生成；
+                    # 其他后端的生成以及标签页池等后端尚有空位时不计入
+                    position += 1 if waiting_line.backend_full else 0
+                    if position != last_position:
+                        send(ws, 'queue', position=position)
+                        last_position = position
+                    time.sleep(poll_interval)
+            finally:
+                waiting_line.leave(ticket)
+        else:
+            latest = store.latest()
+            generation_id = latest['id'] if latest else None
+        if generation_id is None:
+            send(ws, 'done')
+            return
+        trace = tracer.get(generation_id) if tracer is not None else None
+        if trace is not None and message.get('type') == 'submit':
+            trace.add('queue_wait', submitted)
+        send(ws, 'start', generation_id=generation_id)
+
+        # 转发token，直到生成结束且内容读完
+        for content, replace in store.follow(generation_id, events=True):
+            send_started = time.perf_counter()
+            send(ws, 'replace' if replace else 'token', data=content)
+            if trace is not None:
+                trace.count('ws_send', time.perf_counter() - send_started)
+
+        generation = store.get(generation_id)
+        if generation and generation['error']:
+            send(ws, 'error', message=generation['error'])
+        else:
+            send(ws, 'done')
+
+    return True
@@ -0,0 +1,134 @@
+# 语义近似缓存：提示转成向量后和已缓存的提示比较余弦相似度，超过阈值时直接返回缓存的回答
+# 依赖 numpy（pip install numpy），未安装时缓存不启用
+import logging
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    向量保存在一个预分配的 float32 矩阵中（每行一个归一化后的提示向量），一次矩阵乘法完成全部相似度计算。
+    embed(texts) 返回与 texts 一一对应的向量列表，失败时抛出异常。
+    key 区分模型和生成参数，只有 key 相同的条目才会互相命中；条目满后淘汰最久未使用的。
+    """
+
+    def __init__(self, embed, threshold=0.95, near_miss_threshold=0.85, max_entries=1000):
+        self.embed = embed
+        self.threshold = threshold
+        # 相似度在 near_miss_threshold 和 threshold 之间的未命中单独计数，用来调整阈值
+        self.near_miss_threshold = near_miss_threshold
+        self.max_entries = max_entries
+        self.matrix = None
+        self.entries = []
+        self.last_used = np.zeros(max_entries)
+        self.key_ids = np.full(max_entries, -1, dtype=np.int32)
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.near_misses = 0
+        self.inserts = 0
+        self.evictions = 0
+        self.embed_errors = 0
+
+    def _vectors(self, texts):
+        vectors = np.asarray(self.embed(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def lookup_many(self, prompts, key=''):
+        """
+        批量查找，返回 [(条目或None, 相似度, 向量), ...]；向量可以在生成完成后传给 add() 避免重复计算。
+        embedding 失败时条目和向量都为 None。
+        """
+        try:
+            vectors = self._vectors(prompts)
+        except Exception as e:
+            logger.warning(f"计算提示向量失败，跳过语义缓存: {e}")
+            with self.lock:
+                self.lookups += len(prompts)
+                self.embed_errors += 1
+            return [(None, 0.0, None) for _ in prompts]
+
+        results = []
+        with self.lock:
+            self.lookups += len(prompts)
+            key_id = self.keys.get(key)
+            count = len(self.entries)
+            if key_id is None or count == 0 or self.matrix.shape[1] != vectors.shape[1]:
+                return [(None, 0.0, vector) for vector in vectors]
+            scores = self.matrix[:count] @ vectors.T
+            scores[self.key_ids[:count] != key_id] = -1.0
+            best = scores.argmax(axis=0)
+            for column, vector in enumerate(vectors):
+                index = best[column]
+                score = float(scores[index, column])
+                if score >= self.threshold:
+                    self.hits += 1
+                    self.last_used[index] = time.monotonic()
+                    entry = self.entries[index]
+                    entry['hits'] += 1
+                    results.append((entry, score, vector))
+                    continue
+                if score >= self.near_miss_threshold:
+                    self.near_misses += 1
+                results.append((None, score, vector))
+        return results
+
+    def lookup(self, prompt, key=''):
+        return self.lookup_many([prompt], key)[0]
+
+    def add(self, prompt, response, key='', vector=None):
+        if vector is None:
+            try:
+                vector = self._vectors([prompt])[0]
+            except Exception as e:
+                logger.warning(f"计算提示向量失败，不写入语义缓存: {e}")
+                with self.lock:
+                    self.embed_errors += 1
+                return False
+        with self.lock:
+            if self.matrix is None or self.matrix.shape[1] != vector.shape[0]:
+                # 第一次写入或更换了embedding模型，按新的维度重建矩阵
+                self.matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self.entries = []
+            if len(self.entries) < self.max_entries:
+                index = len(self.entries)
+                self.entries.append(None)
+            else:
+                index = int(self.last_used.argmin())
+                self.evictions += 1
+            key_id = self.keys.setdefault(key, len(self.keys))
+            self.matrix[index] = vector
+            self.key_ids[index] = key_id
+            self.last_used[index] = time.monotonic()
+            self.entries[index] = {'prompt': prompt, 'response': response, 'hits': 0}
+            self.inserts += 1
+        return True
+
+    def stats(self):
+        with self.lock:
+            misses = self.lookups - self.hits
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'near_miss_threshold': self.near_miss_threshold,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'misses': misses,
+                'near_misses': self.near_misses,
+                'hit_rate': round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+                'inserts': self.inserts,
+                'evictions': self.evictions,
+                'embed_errors': self.embed_errors,
+                'matrix_bytes': self.matrix.nbytes if self.matrix is not None else 0,
+            }
@@ -0,0 +1,133 @@
+# 请求分阶段耗时记录：每次生成一条trace，记录读取配置、检查服务、建立连接、首token、解析、排队、SSE发送等阶段
+# 最近的trace保存在环形缓冲中，可以转换成Chrome trace-event格式，用 chrome://tracing 或 Perfetto 打开
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import request
+
+
+class Trace:
+    """一个请求的所有阶段。span 记录一段耗时，count 累计高频的小操作（如逐块解析）"""
+
+    def __init__(self, trace_id, name, key=None, **attrs):
+        self.trace_id = trace_id
+        self.name = name
+        self.key = key
+        self.attrs = attrs
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.finished = None
+        self.spans = []
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end=None, **attrs):
+        """添加一个span，start/end 为 time.perf_counter() 的值，end 默认为当前时间"""
+        end = time.perf_counter() if end is None else end
+        with self.lock:
+            self.spans.append({
+                'name': name,
+                'start_ms': round((start - self.origin) * 1000, 3),
+                'duration_ms': round((end - start) * 1000, 3),
+                'thread': threading.get_ident(),
+                **({'attrs': attrs} if attrs else {}),
+            })
+
+    @contextmanager
+    def span(self, name, **attrs):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, **attrs)
+
+    def count(self, name, seconds):
+        with self.lock:
+            total = self.totals.setdefault(name, {'count': 0, 'ms': 0.0})
+            total['count'] += 1
+            total['ms'] += seconds * 1000
+
+    def finish(self, **attrs):
+        self.attrs.update(attrs)
+        self.finished = time.perf_counter()
+
+    def to_dict(self):
+        with self.lock:
+            duration = (self.finished or time.perf_counter()) - self.origin
+            return {
+                'trace_id': self.trace_id,
+                'name': self.name,
+                'key': self.key,
+                'started': self.started,
+                'duration_ms': round(duration * 1000, 3),
+                'finished': self.finished is not None,
+                'attrs': dict(self.attrs),
+                'spans': list(self.spans),
+                'totals': {name: {'count': t['count'], 'ms': round(t['ms'], 3)} for name, t in self.totals.items()},
+            }
+
+
+class Tracer:
+    """保存最近 capacity 条trace；key 通常是生成id，用来让生成线程、SSE和WebSocket把阶段记到同一条trace上"""
+
+    def __init__(self, capacity=200):
+        self.traces = deque(maxlen=capacity)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def start(self, name, key=None, **attrs):
+        trace = Trace(next(self.ids), name, key, **attrs)
+        with self.lock:
+            self.traces.append(trace)
+        return trace
+
+    def get(self, key):
+        with self.lock:
+            for trace in reversed(self.traces):
+                if trace.key == key:
+                    return trace
+        return None
+
+    def recent(self, limit=None):
+        with self.lock:
+            traces = list(self.traces)
+        if limit:
+            traces = traces[-limit:]
+        return [trace.to_dict() for trace in reversed(traces)]
+
+    def chrome_trace(self, limit=None):
+        """转换成Chrome trace-event JSON，每条trace显示为一行，span为完整事件(ph=X)"""
+        pid = os.getpid()
+        events = []
+        for trace in self.recent(limit):
+            base_us = trace['started'] * 1e6
+            events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': trace['trace_id'],
+                'args': {'name': f"{trace['name']} #{trace['trace_id']} key={trace['key']}"},
+            })
+            events.append({
+                'name': trace['name'], 'ph': 'X', 'pid': pid, 'tid': trace['trace_id'],
+                'ts': base_us, 'dur': trace['duration_ms'] * 1000,
+                'args': {**trace['attrs'], 'totals': trace['totals']},
+            })
+            for span in trace['spans']:
+                events.append({
+                    'name': span['name'], 'ph': 'X', 'pid': pid, 'tid': trace['trace_id'],
+                    'ts': base_us + span['start_ms'] * 1000, 'dur': span['duration_ms'] * 1000,
+                    'args': span.get('attrs', {}),
+                })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def register_trace_routes(app, tracer):
+    """注册 /debug/trace：默认返回最近的trace，format=chrome 时返回Chrome trace-event JSON，limit 限制条数"""
+    @app.route('/debug/trace')
+    def debug_trace():
+        limit = request.args.get('limit', type=int)
+        if request.args.get('format') == 'chrome':
+            return tracer.chrome_trace(limit)
+        return {'pid': os.getpid(), 'traces': tracer.recent(limit)}
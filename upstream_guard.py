@@ -0,0 +1,300 @@
+# 上游调用保护：自适应首token截止时间、对冲请求和熔断器
+# connAgent.py 和 local-lama.py 共用
+import logging
+import math
+import threading
+import time
+from collections import deque
+from queue import Queue, Empty
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(requests.exceptions.ConnectionError):
+    """所有上游都处于熔断状态时抛出，沿用requests的连接错误处理分支"""
+
+
+def is_upstream_fault(error):
+    """429限流和凭据耗尽是调用方配额的问题，不应让上游熔断"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code != 429
+    return not getattr(error, 'rate_limited', False)
+
+
+class AdaptiveDeadline:
+    """根据观测到的首token耗时(TTFT)分位数自适应计算截止时间"""
+
+    def __init__(self, percentile=0.95, factor=1.5, min_deadline=2.0, max_deadline=30.0,
+                 initial=10.0, window=100, min_samples=5):
+        self.percentile = percentile
+        self.factor = factor
+        self.min_deadline = min_deadline
+        self.max_deadline = max_deadline
+        self.initial = initial
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, ttft):
+        with self.lock:
+            self.samples.append(ttft)
+
+    def quantile(self, percentile=None):
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        p = self.percentile if percentile is None else percentile
+        index = max(0, math.ceil(p * len(ordered)) - 1)
+        return ordered[index]
+
+    def deadline(self):
+        # 样本不足时使用初始值，避免刚启动时误判
+        if len(self.samples) < self.min_samples:
+            return self.initial
+        value = self.quantile() * self.factor
+        return min(self.max_deadline, max(self.min_deadline, value))
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却期内不再向该上游发送流量"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                # 冷却结束，放行一个试探请求
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def available(self):
+        """不改变状态地判断现在是否会放行请求，供调度时选择后端；与 allow() 的判断一致"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            return self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown
+
+    def cancel_probe(self):
+        """半开状态的试探请求被取消、没有得出结果时重新熔断，冷却后再放行新的试探"""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"熔断器打开，冷却 {self.cooldown} 秒")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class Upstream:
+    """一个上游地址及其截止时间和熔断状态"""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.deadline = AdaptiveDeadline()
+        self.breaker = CircuitBreaker()
+        self.requests = 0
+        self.hedges_won = 0
+
+    def status(self):
+        return {
+            'name': self.name,
+            'url': self.url,
+            'state': self.breaker.state,
+            'failures': self.breaker.failures,
+            'deadline': round(self.deadline.deadline(), 3),
+            'ttft_p50': self.deadline.quantile(0.5),
+            'ttft_p95': self.deadline.quantile(0.95),
+            'requests': self.requests,
+            'hedges_won': self.hedges_won,
+        }
+
+
+class UpstreamPool:
+    """按URL保存上游状态，配置变化时按需创建"""
+
+    def __init__(self):
+        self.upstreams = {}
+        self.lock = threading.Lock()
+
+    def select(self, urls):
+        with self.lock:
+            selected = []
+            for url in urls:
+                if url not in self.upstreams:
+                    self.upstreams[url] = Upstream(f"upstream{len(self.upstreams)}", url)
+                selected.append(self.upstreams[url])
+            return selected
+
+    def status(self):
+        with self.lock:
+            return [u.status() for u in self.upstreams.values()]
+
+
+class _Attempt:
+    def __init__(self, upstream, started):
+        self.upstream = upstream
+        self.started = started
+        self.response = None
+        self.cancelled = False
+        self.failed = False
+        # 是否为熔断器半开状态下放行的试探请求
+        self.probe = False
+        self.resolved = False
+
+    def cancel(self):
+        self.cancelled = True
+        if self.response is not None:
+            try:
+                self.response.close()
+            except Exception:
+                pass
+
+
+def hedged_lines(upstreams, open_stream):
+    """
+    向上游发起流式请求并逐行返回(upstream, line)，空行会被跳过。
+    首行超过该上游的自适应截止时间仍未到达时，向下一个可用上游发起对冲请求，
+    先返回首行的一方胜出，其余请求被关闭。
+    open_stream(upstream) 需要返回一个 stream=True 的 requests.Response，每个请求在各自的线程中调用。
+    """
+    events = Queue()
+    attempts = []
+    pending = list(upstreams)
+
+    def run(attempt):
+        try:
+            response = open_stream(attempt.upstream)
+            attempt.response = response
+            if attempt.cancelled:
+                response.close()
+                return
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if attempt.cancelled:
+                    break
+                if line:
+                    events.put((attempt, 'line', line))
+            events.put((attempt, 'end', None))
+        except Exception as e:
+            events.put((attempt, 'error', e))
+        finally:
+            if attempt.response is not None:
+                attempt.response.close()
+
+    def launch_next():
+        # 熔断器在发起时才检查，半开状态的试探名额不会被白白占用
+        while pending:
+            upstream = pending.pop(0)
+            if not upstream.breaker.allow():
+                continue
+            upstream.requests += 1
+            attempt = _Attempt(upstream, time.monotonic())
+            attempt.probe = upstream.breaker.state == CircuitBreaker.HALF_OPEN
+            attempts.append(attempt)
+            threading.Thread(target=run, args=(attempt,), daemon=True).start()
+            return attempt
+        return None
+
+    first = launch_next()
+    if first is None:
+        raise UpstreamUnavailable("所有上游均处于熔断状态")
+    active = 1
+    hedge_at = time.monotonic() + first.upstream.deadline.deadline()
+    winner = None
+    try:
+        # 等待首行，必要时发起对冲
+        while winner is None:
+            timeout = max(0.0, hedge_at - time.monotonic()) if pending else None
+            try:
+                attempt, kind, payload = events.get(timeout=timeout)
+            except Empty:
+                hedge = launch_next()
+                if hedge is not None:
+                    active += 1
+                    logger.warning(f"首token超时，对冲请求到 {hedge.upstream.url}")
+                    hedge_at = time.monotonic() + hedge.upstream.deadline.deadline()
+                continue
+
+            if attempt.cancelled:
+                continue
+            if kind == 'error':
+                attempt.failed = True
+                attempt.resolved = True
+                if is_upstream_fault(payload):
+                    attempt.upstream.breaker.record_failure()
+                elif attempt.probe:
+                    attempt.upstream.breaker.cancel_probe()
+                active -= 1
+                logger.warning(f"上游 {attempt.upstream.url} 请求失败: {payload}")
+                retry = launch_next()
+                if retry is not None:
+                    active += 1
+                    hedge_at = time.monotonic() + retry.upstream.deadline.deadline()
+                elif active == 0:
+                    raise payload
+                continue
+
+            winner = attempt
+            winner.resolved = True
+            winner.upstream.deadline.record(time.monotonic() - winner.started)
+            winner.upstream.breaker.record_success()
+            if winner is not attempts[0]:
+                winner.upstream.hedges_won += 1
+            for other in attempts:
+                if other is not winner and not other.failed:
+                    # 超过截止时间仍无首行的一方记为失败
+                    if time.monotonic() - other.started >= other.upstream.deadline.deadline():
+                        other.upstream.breaker.record_failure()
+                        other.resolved = True
+                    other.cancel()
+            if kind == 'end':
+                return
+            yield winner.upstream, payload
+
+        # 继续转发胜出一方的数据
+        while True:
+            attempt, kind, payload = events.get()
+            if attempt is not winner:
+                continue
+            if kind == 'line':
+                yield winner.upstream, payload
+            elif kind == 'end':
+                return
+            else:
+                if is_upstream_fault(payload):
+                    winner.upstream.breaker.record_failure()
+                raise payload
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+            # 没有得出结果就被取消的试探请求不能让熔断器一直停在半开状态
+            if attempt.probe and not attempt.resolved:
+                attempt.upstream.breaker.cancel_probe()
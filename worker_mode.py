@@ -0,0 +1,56 @@
+# 多进程工作模式：父进程监听端口，fork出多个工作进程共享同一个监听socket
+# 生成状态保存在 generation_store 中，任意工作进程都能为其他进程启动的生成提供 /stream
+import logging
+import os
+import signal
+import socket
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+
+def worker_count():
+    """实际运行的工作进程数：环境变量 WORKERS，不支持fork的平台（Windows）为1"""
+    if not hasattr(os, 'fork'):
+        return 1
+    return max(1, int(os.environ.get('WORKERS', '1')))
+
+
+def run(app, host='0.0.0.0', port=5000, workers=None):
+    """workers 默认读取环境变量 WORKERS；不支持fork的平台（Windows）退回单进程"""
+    if workers is None:
+        workers = worker_count()
+    if workers <= 1 or not hasattr(os, 'fork'):
+        app.run(host=host, port=port, threaded=True)
+        return
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    listener.set_inheritable(True)
+    logger.info(f"以 {workers} 个工作进程监听 {host}:{port}")
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    listener.close()
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        logger.info("停止所有工作进程")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
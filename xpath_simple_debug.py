@@ -1,9 +1,21 @@
 import asyncio
+import base64
+import codecs
+import itertools
 import json
 import logging
+import math
+from collections import deque
+
 import requests
 import websockets
 
+# 可选依赖 orjson：安装后用它编解码CDP消息，减轻单个消息处理任务的负担
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -12,11 +24,653 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Chrome调试端口地址
+DEBUG_HOST = 'localhost:9222'
+# 元宝对话页面地址
+CHAT_PAGE_URL = 'https://yuanbao.tencent.com/chat'
+# 输入框的CSS选择器
+EDITOR_CSS_SELECTOR = "#app > div > div.yb-layout__content.agent-layout__content > div > div > div.agent-dialogue__content > div > div.Pane.vertical.Pane1 > div > div.agent-dialogue__content--common__input.agent-chat__input-box > div > div.agent-dialogue__content--common__input-box > div > div > div.style__text-area__wrapper___W6mrC > div.style__text-area__start___z71p8.style__tooltipLiteBox___avW6d > div > div > div > div > p"
+# 提交按钮的CSS选择器
+SUBMIT_BUTTON_CSS_SELECTOR = "#yuanbao-send-btn > span"
+# 反馈元素的CSS选择器
+FEEDBACK_CSS_SELECTOR = "#chat-content"
+# 反馈元素中每条AI回复的CSS选择器（根据页面实际结构调整）
+REPLY_CSS_SELECTOR = ".agent-chat__list__item--ai"
+# 聊天接口请求URL中包含的片段，用于从网络流量中捕获回复（根据接口实际地址调整）
+CHAT_API_URL_PATTERN = '/api/chat/'
+# 页面回调Python使用的绑定函数名（Runtime.addBinding）
+NOTIFY_BINDING = '__cdpNotify'
+# CDP命令默认超时（秒）
+COMMAND_TIMEOUT = 10
+# 每个事件订阅最多积压的事件数，超过后丢弃最旧的
+EVENT_QUEUE_SIZE = 1000
+# 保留最近多少个命令往返耗时样本
+RTT_SAMPLES = 1000
+
+if orjson is not None:
+    decode_message = orjson.loads
+
+    def encode_message(message):
+        return orjson.dumps(message).decode()
+else:
+    decode_message = json.loads
+    encode_message = json.dumps
+
+
+def extract_reply_text(line):
+    """从聊天接口响应的一行SSE中取出回复文本，不是文本事件时返回None（根据接口实际格式调整）"""
+    line = line.strip()
+    if not line.startswith('data:'):
+        return None
+    try:
+        event = json.loads(line[5:].strip())
+    except ValueError:
+        return None
+    if isinstance(event, dict) and event.get('type') == 'text':
+        return event.get('msg')
+    return None
+
+
+def percentile(samples, q):
+    """samples 的第 q 百分位数（最近秩法），没有样本时返回None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return round(ordered[rank - 1], 3)
+
+# 页面辅助函数库：每个执行上下文只编译运行一次（Runtime.compileScript/runScript），
+# 之后通过 Runtime.callFunctionOn 按名字调用，参数以JSON值传入，不再拼接到脚本里
+PAGE_HELPERS_JS = '''
+(function() {
+    let waits = {};
+
+    function notify(payload) {
+        window.__cdpNotify(JSON.stringify(payload));
+    }
+
+    function isVisible(element) {
+        let style = window.getComputedStyle(element);
+        return style.display !== 'none' && style.visibility !== 'hidden';
+    }
+
+    function describe(element) {
+        return {
+            found: true,
+            tagName: element.tagName,
+            id: element.id,
+            className: element.className,
+            innerHTML: element.innerHTML.substring(0, 100),
+            outerHTML: element.outerHTML.substring(0, 200),
+            isVisible: isVisible(element),
+            isContentEditable: element.isContentEditable,
+            isConnected: element.isConnected,
+            isDisabled: element.disabled !== undefined ? element.disabled : false,
+            isButton: element.tagName.toLowerCase() === 'button' ||
+                     element.type === 'button' ||
+                     element.type === 'submit' ||
+                     element.role === 'button'
+        };
+    }
+
+    function failure(e) {
+        return {
+            success: false,
+            found: false,
+            error: e.toString(),
+            stack: e.stack || 'No stack trace available'
+        };
+    }
+
+    function isEnabled(element) {
+        let target = element.closest('button, [role=button], #yuanbao-send-btn') || element;
+        let className = typeof target.className === 'string' ? target.className : '';
+        return !target.disabled && target.getAttribute('aria-disabled') !== 'true' && !/disabled/.test(className);
+    }
+
+    function observe(waitId, target, options, callback) {
+        let observer = new MutationObserver(callback);
+        observer.observe(target, options);
+        waits[waitId] = observer;
+        return observer;
+    }
+
+    function finish(waitId) {
+        if (waits[waitId]) {
+            waits[waitId].disconnect();
+            delete waits[waitId];
+        }
+    }
+
+    return {
+        // 按选择器查找元素并返回元素信息
+        describe: function(selector) {
+            try {
+                let element = document.querySelector(selector);
+                return element ? describe(element) : { found: false };
+            } catch (e) {
+                return failure(e);
+            }
+        },
+
+        // 返回已经取到的元素的信息
+        describeElement: function(element) {
+            try {
+                return element ? describe(element) : { found: false };
+            } catch (e) {
+                return failure(e);
+            }
+        },
+
+        // 在可编辑元素中输入文本
+        inputText: function(selector, text) {
+            try {
+                let element = document.querySelector(selector);
+                if (!element) {
+                    return { success: false, error: '元素未找到' };
+                }
+                let tagName = element.tagName.toLowerCase();
+                if (!element.isContentEditable && tagName !== 'input' && tagName !== 'textarea') {
+                    return { success: false, error: '元素不可编辑' };
+                }
+                if (element.isContentEditable) {
+                    // 先直接设置内容，再用execCommand模拟用户输入，触发编辑器的监听
+                    element.textContent = text;
+                    element.focus();
+                    let range = document.createRange();
+                    range.selectNodeContents(element);
+                    let selection = window.getSelection();
+                    selection.removeAllRanges();
+                    selection.addRange(range);
+                    document.execCommand('delete', false, null);
+                    document.execCommand('insertText', false, text);
+                } else {
+                    element.value = text;
+                    element.dispatchEvent(new Event('input', { bubbles: true }));
+                    element.dispatchEvent(new Event('change', { bubbles: true }));
+                }
+                let content = element.isContentEditable ? element.textContent : element.value;
+                return {
+                    success: true,
+                    inputText: text,
+                    actualContent: content.substring(0, 100),
+                    match: content.includes(text)
+                };
+            } catch (e) {
+                return failure(e);
+            }
+        },
+
+        // 点击元素：click()加一组鼠标事件，按钮内部的span同时点击父按钮
+        click: function(selector) {
+            try {
+                let element = document.querySelector(selector);
+                if (!element) {
+                    return { success: false, error: '元素未找到' };
+                }
+                if (!isVisible(element)) {
+                    return { success: false, error: '元素不可见' };
+                }
+                if (element.disabled !== undefined && element.disabled) {
+                    return { success: false, error: '元素被禁用' };
+                }
+                element.click();
+                ['mouseover', 'mousedown', 'mouseup', 'click'].forEach(function(type) {
+                    element.dispatchEvent(new MouseEvent(type, { bubbles: true, cancelable: true }));
+                });
+                let parent = element.parentElement;
+                if (element.tagName.toLowerCase() === 'span' && parent &&
+                    (parent.tagName.toLowerCase() === 'button' ||
+                     parent.type === 'button' ||
+                     parent.type === 'submit' ||
+                     parent.id === 'yuanbao-send-btn')) {
+                    parent.click();
+                }
+                return {
+                    success: true,
+                    elementInfo: {
+                        tagName: element.tagName,
+                        id: element.id,
+                        className: element.className,
+                        parentTag: parent ? parent.tagName : null,
+                        parentId: parent ? parent.id : null
+                    }
+                };
+            } catch (e) {
+                return failure(e);
+            }
+        },
+
+        // 等待元素出现（condition='present'）或可用（condition='enabled'）
+        // 返回 'done' 表示已经满足，'waiting' 表示已开始监听，满足时通过绑定函数通知
+        waitForCondition: function(waitId, selector, condition) {
+            function check() {
+                let element = document.querySelector(selector);
+                return !!element && (condition !== 'enabled' || isEnabled(element));
+            }
+            if (check()) {
+                return 'done';
+            }
+            observe(waitId, document.documentElement, { childList: true, subtree: true, attributes: true, characterData: true }, function() {
+                if (check()) {
+                    finish(waitId);
+                    notify({ waitId: waitId });
+                }
+            });
+            return 'waiting';
+        },
+
+        // 容器内容开始变化后，连续 quietMs 毫秒没有变化即视为回复结束
+        waitForQuiet: function(waitId, selector, quietMs) {
+            let container = document.querySelector(selector);
+            if (!container) {
+                return 'missing';
+            }
+            let timer = null;
+            observe(waitId, container, { childList: true, subtree: true, characterData: true }, function() {
+                clearTimeout(timer);
+                timer = setTimeout(function() {
+                    finish(waitId);
+                    notify({ waitId: waitId });
+                }, quietMs);
+            });
+            return 'waiting';
+        },
+
+        // 监听安装之后出现的最新一条回复，把新增文本推送出去；文本连续 quietMs 毫秒没有变化时推送结束标记
+        watchReply: function(streamId, selector, replySelector, quietMs) {
+            let container = document.querySelector(selector);
+            if (!container) {
+                return 'missing';
+            }
+            let baseline = container.querySelectorAll(replySelector).length;
+            let sent = '';
+            let timer = null;
+            function newestReply() {
+                let replies = container.querySelectorAll(replySelector);
+                return replies.length > baseline ? replies[replies.length - 1].innerText : '';
+            }
+            observe(streamId, container, { childList: true, subtree: true, characterData: true }, function() {
+                let text = newestReply();
+                if (!text || text === sent) {
+                    return;
+                }
+                if (text.startsWith(sent)) {
+                    notify({ streamId: streamId, delta: text.slice(sent.length) });
+                } else {
+                    // 页面重新渲染改变了已推送的内容（如Markdown重新排版），整体替换
+                    notify({ streamId: streamId, replace: text });
+                }
+                sent = text;
+                clearTimeout(timer);
+                timer = setTimeout(function() {
+                    finish(streamId);
+                    notify({ streamId: streamId, done: true });
+                }, quietMs);
+            });
+            return 'waiting';
+        },
+
+        // 取消页面中的等待或监听
+        cancelWait: function(waitId) {
+            finish(waitId);
+        }
+    };
+})()
+'''
+
+# 通过 Runtime.callFunctionOn 调用辅助函数，this 指向辅助函数库对象
+CALL_HELPER_JS = 'function(name, ...args) { return this[name](...args); }'
+
+class ReplyReplace(str):
+    """页面重新渲染后的完整回复文本，接收方应替换已收到的内容而不是追加"""
+
+
+class PageObject:
+    """页面中对象的引用（objectId），作为辅助函数参数时按引用传入"""
+
+    def __init__(self, object_id):
+        self.object_id = object_id
+
+
+class ScriptRegistry:
+    """
+    页面辅助函数注册表。辅助函数库在每个执行上下文中只编译运行一次，
+    之后的调用只发送函数名和JSON参数，页面导航后自动重新安装。
+    """
+
+    def __init__(self, client, source=PAGE_HELPERS_JS):
+        self.client = client
+        self.source = source
+        self.object_id = None
+        self.installs = 0
+        self.listening = False
+
+    def _on_context_cleared(self, params):
+        # 页面导航或刷新后旧的对象失效
+        self.object_id = None
+
+    async def _install(self):
+        if not self.listening:
+            self.client.add_listener('Runtime.executionContextsCleared', self._on_context_cleared)
+            self.client.add_listener('Runtime.executionContextDestroyed', self._on_context_cleared)
+            await self.client.send_command("Runtime.enable")
+            self.listening = True
+        compiled = await self.client.send_command(
+            "Runtime.compileScript",
+            {"expression": self.source, "sourceURL": "page_helpers.js", "persistScript": True}
+        )
+        script_id = (compiled or {}).get('result', {}).get('scriptId')
+        if not script_id:
+            logger.error(f"编译页面辅助函数失败: {compiled}")
+            return False
+        ran = await self.client.send_command("Runtime.runScript", {"scriptId": script_id, "objectGroup": "page_helpers"})
+        self.object_id = (ran or {}).get('result', {}).get('result', {}).get('objectId')
+        if not self.object_id:
+            logger.error(f"运行页面辅助函数失败: {ran}")
+            return False
+        self.installs += 1
+        return True
+
+    async def call(self, name, *args):
+        """调用辅助函数，返回与 execute_script 相同结构的响应"""
+        arguments = [{'value': name}]
+        for arg in args:
+            arguments.append({'objectId': arg.object_id} if isinstance(arg, PageObject) else {'value': arg})
+        for attempt in range(2):
+            if self.object_id is None and not await self._install():
+                return None
+            result = await self.client.send_command(
+                "Runtime.callFunctionOn",
+                {
+                    "functionDeclaration": CALL_HELPER_JS,
+                    "objectId": self.object_id,
+                    "arguments": arguments,
+                    "returnByValue": True,
+                    "awaitPromise": True
+                }
+            )
+            if result and 'error' in result and attempt == 0:
+                # 对象所在的执行上下文已经不存在，重新安装后再试一次
+                logger.debug(f"页面辅助函数失效，重新安装: {result['error']}")
+                self.object_id = None
+                continue
+            return result
+
+    async def call_value(self, name, *args):
+        result = await self.call(name, *args)
+        if result and 'result' in result and 'result' in result['result']:
+            return result['result']['result'].get('value')
+        return None
+
+
+class ResponseCapture:
+    """
+    捕获下一个URL包含 url_pattern 的网络响应，作为异步迭代器按到达顺序产出响应体文本。
+    响应头到达后调用 Network.streamResourceContent，之后的 Network.dataReceived 事件带有数据，边接收边产出；
+    浏览器不支持时退回到加载完成后用 Network.getResponseBody 一次取出。
+    不再需要时（例如请求没有发出）调用 aclose() 取消监听。
+    """
+
+    def __init__(self, client, url_pattern):
+        self.client = client
+        self.url_pattern = url_pattern
+        self.stream_id = f"capture{next(client.wait_ids)}"
+        self.deadline = None
+        self.closed = False
+        self.request_id = None
+        # idle: 未收到响应头 / pending: 正在开启流式读取 / streaming / buffered: 只能等加载完成
+        self.state = 'idle'
+        self.held = []
+        self.finished = False
+        self.queue = asyncio.Queue()
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.tasks = set()
+        self.listeners = [
+            ('Network.requestWillBeSent', self._on_request),
+            ('Network.responseReceived', self._on_response),
+            ('Network.dataReceived', self._on_data),
+            ('Network.loadingFinished', self._on_finished),
+            ('Network.loadingFailed', self._on_failed),
+        ]
+
+    def start(self, timeout):
+        self.deadline = asyncio.get_running_loop().time() + timeout
+        for method, callback in self.listeners:
+            self.client.add_listener(method, callback)
+        # 和页面回复流共用 reply_streams，连接断开时一起收到错误
+        self.client.reply_streams[self.stream_id] = self.queue
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        remaining = self.deadline - asyncio.get_running_loop().time()
+        try:
+            payload = await asyncio.wait_for(self.queue.get(), max(0, remaining))
+        except asyncio.TimeoutError:
+            await self.aclose()
+            raise
+        if payload.get('error'):
+            await self.aclose()
+            raise ConnectionError(payload['error'])
+        if payload.get('done'):
+            await self.aclose()
+            raise StopAsyncIteration
+        return payload['chunk']
+
+    async def aclose(self):
+        if self.closed:
+            return
+        self.closed = True
+        for method, callback in self.listeners:
+            self.client.remove_listener(method, callback)
+        self.client.reply_streams.pop(self.stream_id, None)
+        for task in list(self.tasks):
+            task.cancel()
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _push(self, data, base64_encoded=True):
+        raw = base64.b64decode(data) if base64_encoded else data.encode('utf-8')
+        text = self.decoder.decode(raw)
+        if text:
+            self.queue.put_nowait({'chunk': text})
+
+    def _done(self):
+        rest = self.decoder.decode(b'', final=True)
+        if rest:
+            self.queue.put_nowait({'chunk': rest})
+        self.queue.put_nowait({'done': True})
+
+    def _on_request(self, params):
+        if self.request_id is None and self.url_pattern in params.get('request', {}).get('url', ''):
+            self.request_id = params.get('requestId')
+            logger.info(f"捕获到聊天请求: {params['request']['url']}")
+
+    def _on_response(self, params):
+        if params.get('requestId') == self.request_id and self.state == 'idle':
+            self.state = 'pending'
+            self._spawn(self._enable_streaming())
+
+    def _on_data(self, params):
+        if params.get('requestId') != self.request_id or not params.get('data'):
+            return
+        if self.state == 'streaming':
+            self._push(params['data'])
+        elif self.state == 'pending':
+            # 开启流式读取的响应回来之前先暂存，保证在缓冲数据之后产出
+            self.held.append(params['data'])
+
+    def _on_finished(self, params):
+        if params.get('requestId') != self.request_id:
+            return
+        self.finished = True
+        if self.state == 'streaming':
+            self._done()
+        elif self.state in ('idle', 'buffered'):
+            self._spawn(self._read_body())
+
+    def _on_failed(self, params):
+        if params.get('requestId') == self.request_id:
+            self.queue.put_nowait({'error': f"聊天请求失败: {params.get('errorText', '')}"})
+
+    async def _enable_streaming(self):
+        result = await self.client.send_command("Network.streamResourceContent", {"requestId": self.request_id})
+        if result and 'result' in result:
+            self.state = 'streaming'
+            if result['result'].get('bufferedData'):
+                self._push(result['result']['bufferedData'])
+            for data in self.held:
+                self._push(data)
+            self.held = []
+            if self.finished:
+                self._done()
+            return
+        logger.info(f"不支持流式读取响应，改为加载完成后读取: {(result or {}).get('error')}")
+        self.state = 'buffered'
+        self.held = []
+        if self.finished:
+            await self._read_body()
+
+    async def _read_body(self):
+        result = await self.client.send_command("Network.getResponseBody", {"requestId": self.request_id})
+        if not result or 'result' not in result:
+            self.queue.put_nowait({'error': f"读取响应体失败: {(result or {}).get('error')}"})
+            return
+        self._push(result['result'].get('body', ''), result['result'].get('base64Encoded', False))
+        self._done()
+
+
+class SSEReply:
+    """把聊天接口的响应体按行解析，逐个产出回复文本增量"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = ''
+        self.pending = deque()
+        self.ended = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.pending:
+            if self.ended:
+                raise StopAsyncIteration
+            try:
+                self.buffer += await self.chunks.__anext__()
+                *lines, self.buffer = self.buffer.split('\n')
+            except StopAsyncIteration:
+                self.ended = True
+                lines, self.buffer = [self.buffer], ''
+            self.pending.extend(text for text in map(extract_reply_text, lines) if text)
+        return self.pending.popleft()
+
+    async def aclose(self):
+        await self.chunks.aclose()
+
+
+class EventSubscription:
+    """
+    on() 返回的事件订阅，事件参数放入有界队列，用 async for 或 get() 读取。
+    队列满时丢弃最旧的事件并计数，慢消费者不会拖住消息处理任务；连接断开或 close() 后订阅结束。
+    """
+
+    def __init__(self, client, method, maxsize=EVENT_QUEUE_SIZE):
+        self.client = client
+        self.method = method
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.closed = False
+
+    def _put(self, params):
+        if self.closed:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(params)
+
+    def _end(self):
+        # 放入结束标记
+        if self.closed:
+            return
+        self.closed = True
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(None)
+
+    async def get(self, timeout=None):
+        """取下一个事件的参数，订阅结束返回None，超时抛出 asyncio.TimeoutError"""
+        if self.closed and self.queue.empty():
+            return None
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        params = await self.get()
+        if params is None:
+            raise StopAsyncIteration
+        return params
+
+    def close(self):
+        self.client.remove_listener(self.method, self._put)
+        self.client.subscriptions.discard(self)
+        self._end()
+
+
 class ChromeDevToolsClient:
-    def __init__(self):
+    """
+    CDP客户端。connect(ws_url) 直接连接一个标签页或整个浏览器；
+    连接浏览器时 attach(target_id) 返回共享同一个WebSocket的会话客户端（flatten模式，按sessionId路由）。
+    """
+
+    def __init__(self, connection=None, session_id=None, command_timeout=COMMAND_TIMEOUT):
         self.websocket = None
+        self.command_timeout = command_timeout
+        # 会话客户端通过所属的浏览器连接收发消息
+        self.connection = connection
+        self.session_id = session_id
+        self.target_id = None
+        self.detached = False
         self.message_id = 1
         self.response_waiting = {}
+        # 浏览器连接上已附加的会话: sessionId -> 会话客户端
+        self.sessions = {}
+        # 已发现的调试目标: targetId -> TargetInfo
+        self.targets = {}
+        self.discovering = False
+        # CDP事件监听: 事件名 -> 回调列表
+        self.event_listeners = {}
+        self.subscriptions = set()
+        # 计数（只在持有WebSocket的连接上累计）
+        self.commands_sent = 0
+        self.command_timeouts = 0
+        self.command_errors = 0
+        self.events_received = 0
+        self.rtt_samples = deque(maxlen=RTT_SAMPLES)
+        # 页面中等待的条件: waitId -> Future
+        self.dom_waits = {}
+        self.wait_ids = itertools.count(1)
+        self.binding_ready = False
+        self.network_enabled = False
+        self.performance_enabled = False
+        # Fetch拦截屏蔽的请求数
+        self.blocked_requests = 0
+        self.tasks = set()
+        # 页面推送的回复增量: streamId -> Queue
+        self.reply_streams = {}
+        # 页面辅助函数
+        self.scripts = ScriptRegistry(self)
     
     async def connect(self, ws_url):
         try:
@@ -28,21 +682,73 @@ class ChromeDevToolsClient:
         except Exception as e:
             logger.error(f"连接Chrome调试端口失败: {str(e)}")
             return False
+
+    def is_connected(self):
+        if self.connection is not None:
+            return not self.detached and self.connection.is_connected()
+        task = getattr(self, 'message_task', None)
+        return self.websocket is not None and task is not None and not task.done()
     
     async def _process_messages(self):
         try:
             while self.websocket:
                 message = await self.websocket.recv()
-                response = json.loads(message)
+                response = decode_message(message)
                 msg_id = response.get('id')
                 
                 if msg_id in self.response_waiting:
-                    self.response_waiting[msg_id].set_result(response)
+                    future = self.response_waiting[msg_id]
+                    if not future.done():
+                        future.set_result(response)
+                elif msg_id is None and 'method' in response:
+                    self.events_received += 1
+                    # 带sessionId的事件属于某个已附加的会话
+                    session_id = response.get('sessionId')
+                    if session_id is None:
+                        self._dispatch_event(response['method'], response.get('params', {}))
+                    elif session_id in self.sessions:
+                        self.sessions[session_id]._dispatch_event(response['method'], response.get('params', {}))
         except Exception as e:
             logger.error(f"消息处理异常: {str(e)}")
+        finally:
+            # 连接已断开，等待中的命令和订阅立即结束，不再等到超时
+            error = ConnectionError("Chrome调试连接已断开")
+            self._fail_pending(error)
+            for session in list(self.sessions.values()):
+                session._fail_pending(error)
+
+    def _fail_pending(self, error):
+        for future in self.response_waiting.values():
+            if not future.done():
+                future.set_exception(error)
+        for future in self.dom_waits.values():
+            if not future.done():
+                future.set_result({'error': str(error)})
+        for queue in self.reply_streams.values():
+            queue.put_nowait({'error': str(error)})
+        for subscription in list(self.subscriptions):
+            subscription._end()
+
+    def _dispatch_event(self, method, params):
+        # CDP事件，分发给监听回调
+        for callback in list(self.event_listeners.get(method, [])):
+            try:
+                callback(params)
+            except Exception as e:
+                logger.error(f"事件回调异常 {method}: {str(e)}")
     
-    async def send_command(self, method, params=None):
-        if not self.websocket:
+    async def send_command(self, method, params=None, timeout=None):
+        """发送命令并等待响应，超时、断开或出错时返回None；timeout 默认为 command_timeout"""
+        timeout = self.command_timeout if timeout is None else timeout
+        if self.connection is not None:
+            if self.detached:
+                logger.error(f"会话 {self.session_id} 已断开")
+                return None
+            return await self.connection._send(method, params, self.session_id, timeout)
+        return await self._send(method, params, None, timeout)
+
+    async def _send(self, method, params, session_id, timeout):
+        if not self.is_connected():
             logger.error("WebSocket连接未建立")
             return None
         
@@ -54,21 +760,28 @@ class ChromeDevToolsClient:
             'method': method,
             'params': params or {}
         }
+        if session_id:
+            command['sessionId'] = session_id
         
         # 创建一个Future对象来等待响应
-        future = asyncio.Future()
+        future = asyncio.get_running_loop().create_future()
         self.response_waiting[msg_id] = future
+        started = asyncio.get_running_loop().time()
+        self.commands_sent += 1
         
         try:
             # 发送命令
-            await self.websocket.send(json.dumps(command))
+            await self.websocket.send(encode_message(command))
             # 等待响应，设置超时
-            response = await asyncio.wait_for(future, timeout=10)
+            response = await asyncio.wait_for(future, timeout=timeout)
+            self.rtt_samples.append((asyncio.get_running_loop().time() - started) * 1000)
             return response
         except asyncio.TimeoutError:
+            self.command_timeouts += 1
             logger.error(f"命令 {method} 超时")
             return None
         except Exception as e:
+            self.command_errors += 1
             logger.error(f"发送命令异常: {str(e)}")
             return None
         finally:
@@ -89,7 +802,304 @@ class ChromeDevToolsClient:
         )
         return result
     
+    def add_listener(self, method, callback):
+        self.event_listeners.setdefault(method, []).append(callback)
+
+    def remove_listener(self, method, callback):
+        if callback in self.event_listeners.get(method, []):
+            self.event_listeners[method].remove(callback)
+
+    def on(self, method, maxsize=EVENT_QUEUE_SIZE):
+        """订阅一种CDP事件，返回 EventSubscription，用完后调用 close()"""
+        subscription = EventSubscription(self, method, maxsize)
+        self.add_listener(method, subscription._put)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    async def wait_for_event(self, method, predicate=None, timeout=10):
+        """等待一个CDP事件，超时或连接断开返回None"""
+        subscription = self.on(method)
+
+        async def first_match():
+            async for params in subscription:
+                if predicate is None or predicate(params):
+                    return params
+            return None
+
+        try:
+            return await asyncio.wait_for(first_match(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            subscription.close()
+
+    def stats(self):
+        """命令和事件计数；会话的命令计数来自所属的浏览器连接"""
+        owner = self.connection or self
+        clients = [self] if self.connection is not None else [self, *self.sessions.values()]
+        subscriptions = [s for client in clients for s in client.subscriptions]
+        return {
+            'in_flight': len(owner.response_waiting),
+            'commands': owner.commands_sent,
+            'timeouts': owner.command_timeouts,
+            'errors': owner.command_errors,
+            'events': owner.events_received,
+            'subscriptions': len(subscriptions),
+            'event_backlog': sum(s.queue.qsize() for s in subscriptions),
+            'dropped_events': sum(s.dropped for s in subscriptions),
+            'rtt_ms': {
+                'p50': percentile(owner.rtt_samples, 50),
+                'p95': percentile(owner.rtt_samples, 95),
+                'p99': percentile(owner.rtt_samples, 99),
+            },
+        }
+
+    async def _evaluate_value(self, expression):
+        result = await self.send_command(
+            "Runtime.evaluate",
+            {"expression": expression, "returnByValue": True, "awaitPromise": True}
+        )
+        if result and 'result' in result and 'result' in result['result']:
+            return result['result']['result'].get('value')
+        return None
+
+    async def _ensure_binding(self):
+        # 绑定函数在页面导航后依然有效，每个连接只需添加一次
+        if self.binding_ready:
+            return
+        self.add_listener('Runtime.bindingCalled', self._on_binding_called)
+        await self.send_command("Runtime.enable")
+        await self.send_command("Runtime.addBinding", {"name": NOTIFY_BINDING})
+        self.binding_ready = True
+
+    def _on_binding_called(self, params):
+        if params.get('name') != NOTIFY_BINDING:
+            return
+        try:
+            payload = json.loads(params.get('payload', '{}'))
+        except ValueError:
+            return
+        if 'streamId' in payload:
+            queue = self.reply_streams.get(payload['streamId'])
+            if queue is not None:
+                queue.put_nowait(payload)
+            return
+        future = self.dom_waits.get(payload.get('waitId'))
+        if future is not None and not future.done():
+            future.set_result(payload)
+
+    async def _wait_in_page(self, helper, args, timeout):
+        """调用页面中的等待函数并等待页面通过绑定函数通知，返回是否在截止时间前满足"""
+        await self._ensure_binding()
+        wait_id = next(self.wait_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.dom_waits[wait_id] = future
+        try:
+            state = await self.scripts.call_value(helper, wait_id, *args)
+            if state == 'done':
+                return True
+            if state != 'waiting':
+                return False
+            payload = await asyncio.wait_for(future, timeout)
+            return 'error' not in payload
+        except asyncio.TimeoutError:
+            await self.scripts.call('cancelWait', wait_id)
+            return False
+        finally:
+            del self.dom_waits[wait_id]
+
+    async def wait_for_load(self, timeout=30):
+        """等待页面load事件；页面已经加载完成时立即返回"""
+        await self.send_command("Page.enable")
+        await self.send_command("Page.setLifecycleEventsEnabled", {"enabled": True})
+        loaded = asyncio.create_task(self.wait_for_event(
+            "Page.lifecycleEvent", lambda params: params.get('name') == 'load', timeout
+        ))
+        await asyncio.sleep(0)
+        if await self._evaluate_value("document.readyState") == 'complete':
+            loaded.cancel()
+            return True
+        if await loaded is None:
+            logger.warning("等待页面加载超时")
+            return False
+        return True
+
+    async def wait_for_selector(self, selector, timeout=10):
+        """等待元素出现"""
+        found = await self._wait_in_page('waitForCondition', (selector, 'present'), timeout)
+        if not found:
+            logger.warning(f"等待元素出现超时: {selector}")
+        return found
+
+    async def wait_for_element_enabled(self, selector, timeout=10):
+        """等待元素（或其所在按钮）可用"""
+        enabled = await self._wait_in_page('waitForCondition', (selector, 'enabled'), timeout)
+        if not enabled:
+            logger.warning(f"等待元素可用超时: {selector}")
+        return enabled
+
+    async def wait_for_reply_finished(self, selector, quiet=1.5, timeout=120):
+        """等待回复结束：容器内容开始变化后连续 quiet 秒没有变化"""
+        finished = await self._wait_in_page('waitForQuiet', (selector, int(quiet * 1000)), timeout)
+        if not finished:
+            logger.warning(f"等待回复结束超时: {selector}")
+        return finished
+
+    async def watch_reply(self, selector, reply_selector=REPLY_CSS_SELECTOR, quiet=1.5, timeout=120):
+        """
+        开始监听 selector 中的最新回复，应在点击发送之前调用。
+        返回一个异步迭代器，逐个产出回复的新增文本；已推送的内容被页面改写时产出 ReplyReplace（完整回复）。
+        回复结束后迭代结束，超时抛出 asyncio.TimeoutError；找不到回复区域时返回 None。
+        """
+        await self._ensure_binding()
+        stream_id = f"reply{next(self.wait_ids)}"
+        queue = asyncio.Queue()
+        self.reply_streams[stream_id] = queue
+        state = await self.scripts.call_value('watchReply', stream_id, selector, reply_selector, int(quiet * 1000))
+        if state != 'waiting':
+            del self.reply_streams[stream_id]
+            logger.warning(f"未找到回复区域: {selector}")
+            return None
+        return self._iterate_reply(stream_id, queue, timeout)
+
+    async def _iterate_reply(self, stream_id, queue, timeout):
+        deadline = asyncio.get_running_loop().time() + timeout
+        try:
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                payload = await asyncio.wait_for(queue.get(), max(0, remaining))
+                if payload.get('error'):
+                    raise ConnectionError(payload['error'])
+                if payload.get('done'):
+                    return
+                if 'replace' in payload:
+                    yield ReplyReplace(payload['replace'])
+                elif payload.get('delta'):
+                    yield payload['delta']
+        finally:
+            self.reply_streams.pop(stream_id, None)
+            if self.is_connected():
+                await self.scripts.call('cancelWait', stream_id)
+
+    async def capture_response(self, url_pattern=CHAT_API_URL_PATTERN, timeout=120):
+        """
+        开始捕获下一个URL包含 url_pattern 的响应，应在触发请求之前调用。
+        返回一个异步迭代器，逐块产出响应体文本；加载完成后迭代结束，超时抛出 asyncio.TimeoutError。
+        """
+        if not self.network_enabled:
+            await self.send_command("Network.enable")
+            self.network_enabled = True
+        capture = ResponseCapture(self, url_pattern)
+        capture.start(timeout)
+        return capture
+
+    async def watch_network_reply(self, url_pattern=CHAT_API_URL_PATTERN, timeout=120):
+        """
+        和 watch_reply 相同的用法，但回复文本直接取自聊天接口的流式响应，不等页面渲染。
+        应在点击发送之前调用，返回逐个产出回复新增文本的异步迭代器。
+        """
+        return SSEReply(await self.capture_response(url_pattern, timeout))
+
+    async def navigate(self, url):
+        result = await self.send_command("Page.navigate", {"url": url})
+        return bool(result and 'result' in result and not result['result'].get('errorText'))
+
+    async def enable_blocking(self, resource_types=(), url_patterns=()):
+        """
+        用 Fetch 请求拦截屏蔽不需要的资源。resource_types 为CDP资源类型（Image、Font、Media等），
+        url_patterns 为通配符URL模式；只有命中的请求会被暂停，暂停后直接以 BlockedByClient 失败。
+        """
+        patterns = [{'urlPattern': '*', 'resourceType': t, 'requestStage': 'Request'} for t in resource_types]
+        patterns += [{'urlPattern': pattern, 'requestStage': 'Request'} for pattern in url_patterns]
+        if not patterns:
+            return False
+        if self._on_request_paused not in self.event_listeners.get('Fetch.requestPaused', []):
+            self.add_listener('Fetch.requestPaused', self._on_request_paused)
+        result = await self.send_command("Fetch.enable", {"patterns": patterns})
+        return bool(result and 'result' in result)
+
+    def _on_request_paused(self, params):
+        self.blocked_requests += 1
+        task = asyncio.ensure_future(self.send_command(
+            "Fetch.failRequest", {"requestId": params['requestId'], "errorReason": "BlockedByClient"}
+        ))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def get_metrics(self):
+        """读取 Performance.getMetrics，返回 指标名 -> 数值，失败返回空字典"""
+        if not self.performance_enabled:
+            await self.send_command("Performance.enable")
+            self.performance_enabled = True
+        result = await self.send_command("Performance.getMetrics")
+        if not result or 'result' not in result:
+            return {}
+        return {metric['name']: metric['value'] for metric in result['result'].get('metrics', [])}
+
+    async def discover_targets(self):
+        """开启目标发现并返回当前已知目标，之后 targets 随 Target.targetCreated/targetInfoChanged/targetDestroyed 事件更新"""
+        if not self.discovering:
+            self.add_listener('Target.targetCreated', self._on_target_info)
+            self.add_listener('Target.targetInfoChanged', self._on_target_info)
+            self.add_listener('Target.targetDestroyed', self._on_target_destroyed)
+            # 已存在的目标会在命令返回前以 targetCreated 事件推送
+            await self.send_command("Target.setDiscoverTargets", {"discover": True})
+            self.discovering = True
+        return list(self.targets.values())
+
+    def _on_target_info(self, params):
+        info = params.get('targetInfo', {})
+        if info.get('targetId'):
+            self.targets[info['targetId']] = info
+
+    def _on_target_destroyed(self, params):
+        self.targets.pop(params.get('targetId'), None)
+
+    def _on_detached(self, params):
+        session = self.sessions.pop(params.get('sessionId'), None)
+        if session is not None:
+            session.detached = True
+            session._fail_pending(ConnectionError("会话已被分离"))
+
+    async def create_target(self, url):
+        """新建标签页，返回targetId"""
+        result = await self.send_command("Target.createTarget", {"url": url})
+        target_id = (result or {}).get('result', {}).get('targetId')
+        if not target_id:
+            logger.error(f"创建标签页失败: {result}")
+        return target_id
+
+    async def close_target(self, target_id):
+        await self.send_command("Target.closeTarget", {"targetId": target_id})
+
+    async def attach(self, target_id):
+        """以flatten模式附加到目标，返回共享本连接的会话客户端，失败返回None"""
+        if self._on_detached not in self.event_listeners.get('Target.detachedFromTarget', []):
+            self.add_listener('Target.detachedFromTarget', self._on_detached)
+        result = await self.send_command("Target.attachToTarget", {"targetId": target_id, "flatten": True})
+        session_id = (result or {}).get('result', {}).get('sessionId')
+        if not session_id:
+            logger.error(f"附加到目标失败 {target_id}: {result}")
+            return None
+        session = ChromeDevToolsClient(connection=self, session_id=session_id, command_timeout=self.command_timeout)
+        session.target_id = target_id
+        self.sessions[session_id] = session
+        return session
+
     async def close(self):
+        if self.connection is not None:
+            # 会话只断开自己，浏览器连接保持
+            if not self.detached:
+                self.detached = True
+                self._fail_pending(ConnectionError("会话已关闭"))
+                self.connection.sessions.pop(self.session_id, None)
+                await self.connection.send_command("Target.detachFromTarget", {"sessionId": self.session_id})
+            return
+
+        for session in self.sessions.values():
+            session.detached = True
+            session._fail_pending(ConnectionError("Chrome调试连接已关闭"))
+        self.sessions = {}
         if hasattr(self, 'message_task'):
             self.message_task.cancel()
         
@@ -101,74 +1111,52 @@ class ChromeDevToolsClient:
                 logger.error(f"关闭WebSocket连接异常: {str(e)}")
         self.websocket = None
 
-def find_chrome_debugging_targets():
-    """获取Chrome调试目标列表"""
+async def get_browser_ws_url(debug_host=DEBUG_HOST):
+    """读取浏览器级调试地址，只在建立连接时请求一次，不阻塞事件循环"""
     try:
-        response = requests.get('http://localhost:9222/json')
-        if response.status_code == 200:
-            targets = response.json()
-            logger.info(f"找到 {len(targets)} 个调试目标:")
-            
-            # 优先选择非DevTools页面
-            page_targets = [t for t in targets if t.get('type') == 'page' and not t.get('url', '').startswith('devtools://')]
-            devtools_targets = [t for t in targets if t.get('type') == 'page' and t.get('url', '').startswith('devtools://')]
-            
-            all_targets = page_targets + devtools_targets
-            
-            for i, target in enumerate(all_targets):
-                logger.info(f" {i}: {target.get('title', 'Untitled')} - {target.get('type', 'unknown')} - {target.get('url', 'unknown')}")
-            
-            # 优先返回非DevTools页面
-            if page_targets:
-                return page_targets
-            return all_targets
-        else:
-            logger.error(f"获取Chrome调试目标失败，HTTP状态码: {response.status_code}")
-            return []
+        response = await asyncio.to_thread(requests.get, f'http://{debug_host}/json/version', timeout=5)
+        return response.json().get('webSocketDebuggerUrl')
     except Exception as e:
-        logger.error(f"获取Chrome调试目标异常: {str(e)}")
-        return []
+        logger.error(f"获取浏览器调试地址异常: {str(e)}")
+        return None
+
+async def connect_browser(debug_host=DEBUG_HOST):
+    """连接浏览器级调试端口并开启目标发现，失败返回None"""
+    ws_url = await get_browser_ws_url(debug_host)
+    if not ws_url:
+        return None
+    browser = ChromeDevToolsClient()
+    if not await browser.connect(ws_url):
+        return None
+    await browser.discover_targets()
+    return browser
+
+async def find_chrome_debugging_targets(browser):
+    """获取Chrome调试目标列表"""
+    targets = await browser.discover_targets()
+    logger.info(f"找到 {len(targets)} 个调试目标:")
+    
+    # 优先选择非DevTools页面
+    page_targets = [t for t in targets if t.get('type') == 'page' and not t.get('url', '').startswith('devtools://')]
+    devtools_targets = [t for t in targets if t.get('type') == 'page' and t.get('url', '').startswith('devtools://')]
+    
+    all_targets = page_targets + devtools_targets
+    
+    for i, target in enumerate(all_targets):
+        logger.info(f" {i}: {target.get('title', 'Untitled')} - {target.get('type', 'unknown')} - {target.get('url', 'unknown')}")
+    
+    # 优先返回非DevTools页面
+    if page_targets:
+        return page_targets
+    return all_targets
 
 async def test_selector(client, selector_name, selector_value):
     """测试选择器 - 修复了响应处理逻辑"""
     logger.info(f"测试选择器 '{selector_name}': {selector_value}")
     
-    # 修复JavaScript代码，使用正确的函数包装
-    script = f'''
-        try {{
-            let element = document.querySelector('{selector_value}');
-            if (element) {{
-                return {{
-                    found: true,
-                    tagName: element.tagName,
-                    id: element.id,
-                    className: element.className,
-                    innerHTML: element.innerHTML.substring(0, 100),
-                    outerHTML: element.outerHTML.substring(0, 200),
-                    isVisible: window.getComputedStyle(element).display !== 'none' && 
-                               window.getComputedStyle(element).visibility !== 'hidden',
-                    isContentEditable: element.isContentEditable,
-                    isConnected: element.isConnected,
-                    isDisabled: element.disabled !== undefined ? element.disabled : false,
-                    isButton: element.tagName.toLowerCase() === 'button' || 
-                             element.type === 'button' || 
-                             element.type === 'submit' ||
-                             element.role === 'button'
-                }};
-            }} else {{
-                return {{ found: false }};
-            }}
-        }} catch (e) {{
-            return {{
-                found: false,
-                error: e.toString(),
-                stack: e.stack || 'No stack trace available'
-            }};
-        }}
-    '''
-    
     try:
-        result = await client.execute_script(script)
+        # 调用页面中已安装的辅助函数，选择器作为参数传入
+        result = await client.scripts.call('describe', selector_value)
         
         # 打印原始响应以便调试
         logger.debug(f"原始响应: {result}")
@@ -205,69 +1193,9 @@ async def input_text_in_element(client, selector_value, text_to_input):
     """在指定的元素中输入文本"""
     logger.info(f"在元素 {selector_value} 中输入文本: {text_to_input}")
     
-    # 使用多种方法尝试在可编辑元素中输入文本
-    script = f'''
-        try {{
-            let element = document.querySelector('{selector_value}');
-            if (!element) {{
-                return {{ success: false, error: '元素未找到' }};
-            }}
-            
-            // 确保元素可见且可编辑
-            if (!element.isContentEditable && 
-                element.tagName.toLowerCase() !== 'input' && 
-                element.tagName.toLowerCase() !== 'textarea') {{
-                return {{ success: false, error: '元素不可编辑' }};
-            }}
-            
-            // 方法1: 直接设置innerHTML
-            element.innerHTML = '{text_to_input}';
-            
-            // 方法2: 如果是可编辑元素，也可以使用execCommand模拟用户输入
-            if (element.isContentEditable) {{
-                // 聚焦到元素
-                element.focus();
-                
-                // 创建Range并选择元素内容
-                let range = document.createRange();
-                range.selectNodeContents(element);
-                let selection = window.getSelection();
-                selection.removeAllRanges();
-                selection.addRange(range);
-                
-                // 清除原有内容
-                document.execCommand('delete', false, null);
-                
-                // 插入新文本
-                document.execCommand('insertText', false, '{text_to_input}');
-            }} else if (element.tagName.toLowerCase() === 'input' || 
-                      element.tagName.toLowerCase() === 'textarea') {{
-                // 对于input和textarea，直接设置value
-                element.value = '{text_to_input}';
-                // 触发必要的事件
-                element.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                element.dispatchEvent(new Event('change', {{ bubbles: true }}));
-            }}
-            
-            // 验证文本是否成功输入
-            let content = element.isContentEditable ? element.textContent : element.value;
-            return {{
-                success: true,
-                inputText: '{text_to_input}',
-                actualContent: content.substring(0, 100),
-                match: content.includes('{text_to_input}')
-            }};
-        }} catch (e) {{
-            return {{
-                success: false,
-                error: e.toString(),
-                stack: e.stack || 'No stack trace available'
-            }};
-        }}
-    '''
-    
     try:
-        result = await client.execute_script(script)
+        # 使用多种方法尝试在可编辑元素中输入文本，文本作为JSON参数传入，引号等字符不需要转义
+        result = await client.scripts.call('inputText', selector_value, text_to_input)
         
         # 打印原始响应以便调试
         logger.debug(f"原始响应: {result}")
@@ -298,71 +1226,8 @@ async def click_element(client, selector_value):
     """点击指定的元素"""
     logger.info(f"尝试点击元素: {selector_value}")
     
-    script = f'''
-        try {{
-            let element = document.querySelector('{selector_value}');
-            if (!element) {{
-                return {{ success: false, error: '元素未找到' }};
-            }}
-            
-            // 检查元素是否可见
-            let isVisible = window.getComputedStyle(element).display !== 'none' && 
-                            window.getComputedStyle(element).visibility !== 'hidden';
-            if (!isVisible) {{
-                return {{ success: false, error: '元素不可见' }};
-            }}
-            
-            // 检查元素是否可点击
-            let isDisabled = element.disabled !== undefined ? element.disabled : false;
-            if (isDisabled) {{
-                return {{ success: false, error: '元素被禁用' }};
-            }}
-            
-            // 尝试多种点击方法
-            
-            // 方法1: 直接调用click()
-            element.click();
-            
-            // 方法2: 模拟鼠标事件序列
-            let events = [
-                new MouseEvent('mouseover', {{ bubbles: true, cancelable: true }}),
-                new MouseEvent('mousedown', {{ bubbles: true, cancelable: true }}),
-                new MouseEvent('mouseup', {{ bubbles: true, cancelable: true }}),
-                new MouseEvent('click', {{ bubbles: true, cancelable: true }})
-            ];
-            
-            events.forEach(event => element.dispatchEvent(event));
-            
-            // 尝试点击父元素（如果是按钮内部的span元素）
-            if (element.tagName.toLowerCase() === 'span' && 
-                (element.parentElement.tagName.toLowerCase() === 'button' || 
-                 element.parentElement.type === 'button' || 
-                 element.parentElement.type === 'submit' ||
-                 element.parentElement.id === 'yuanbao-send-btn')) {{
-                element.parentElement.click();
-            }}
-            
-            return {{ 
-                success: true,
-                elementInfo: {{
-                    tagName: element.tagName,
-                    id: element.id,
-                    className: element.className,
-                    parentTag: element.parentElement ? element.parentElement.tagName : null,
-                    parentId: element.parentElement ? element.parentElement.id : null
-                }}
-            }};
-        }} catch (e) {{
-            return {{
-                success: false,
-                error: e.toString(),
-                stack: e.stack || 'No stack trace available'
-            }};
-        }}
-    '''
-    
     try:
-        result = await client.execute_script(script)
+        result = await client.scripts.call('click', selector_value)
         
         # 打印原始响应以便调试
         logger.debug(f"原始响应: {result}")
@@ -405,42 +1270,19 @@ async def test_js_path(client, js_path):
                 # 直接使用test_selector函数来处理，因为它已经被验证可以正常工作
                 return await test_selector(client, "JS路径提取的选择器", selector_value)
     
-    # 如果格式不正确，尝试直接执行JavaScript路径
-    script = f'''
-        try {{
-            let element = {js_path};
-            if (element) {{
-                return {{
-                    found: true,
-                    tagName: element.tagName,
-                    id: element.id,
-                    className: element.className,
-                    innerHTML: element.innerHTML.substring(0, 100),
-                    outerHTML: element.outerHTML.substring(0, 200),
-                    isVisible: window.getComputedStyle(element).display !== 'none' && 
-                               window.getComputedStyle(element).visibility !== 'hidden',
-                    isContentEditable: element.isContentEditable,
-                    isConnected: element.isConnected,
-                    isDisabled: element.disabled !== undefined ? element.disabled : false,
-                    isButton: element.tagName.toLowerCase() === 'button' || 
-                             element.type === 'button' || 
-                             element.type === 'submit' ||
-                             element.role === 'button'
-                }};
-            }} else {{
-                return {{ found: false }};
-            }}
-        }} catch (e) {{
-            return {{
-                found: false,
-                error: e.toString(),
-                stack: e.stack || 'No stack trace available'
-            }};
-        }}
-    '''
-    
+    # 如果格式不正确，尝试直接执行JavaScript路径，取得元素引用后交给页面辅助函数描述
     try:
-        result = await client.execute_script(script)
+        evaluated = await client.send_command("Runtime.evaluate", {"expression": js_path})
+        remote = (evaluated or {}).get('result', {})
+        if 'exceptionDetails' in remote:
+            result = {'result': {'result': {'value': {
+                'found': False,
+                'error': remote['exceptionDetails'].get('exception', {}).get('description', remote['exceptionDetails'].get('text', ''))
+            }}}}
+        elif remote.get('result', {}).get('objectId'):
+            result = await client.scripts.call('describeElement', PageObject(remote['result']['objectId']))
+        else:
+            result = {'result': {'result': {'value': {'found': False}}}}
         
         # 打印原始响应以便调试
         logger.debug(f"原始响应: {result}")
@@ -474,37 +1316,40 @@ async def test_js_path(client, js_path):
         return False, None
 
 async def main():
-    # 获取Chrome调试目标
-    targets = find_chrome_debugging_targets()
+    # 连接浏览器并获取Chrome调试目标
+    browser = await connect_browser()
+    if browser is None:
+        logger.error("无法连接到Chrome调试端口，请确保Chrome已启动并开启调试模式")
+        return
+    targets = await find_chrome_debugging_targets(browser)
     if not targets:
         logger.error("未找到Chrome调试目标，请确保Chrome已启动并开启调试模式")
+        await browser.close()
         return
     
     # 选择第一个目标
     target = targets[0]
-    ws_url = target.get('webSocketDebuggerUrl')
     logger.info(f"连接到目标: {target.get('title', 'Untitled')} - {target.get('url', 'unknown')}")
     
-    # 创建客户端并连接
-    client = ChromeDevToolsClient()
-    
     try:
-        # 连接到调试端口
-        if not await client.connect(ws_url):
-            logger.error("无法连接到Chrome调试端口")
+        # 通过浏览器连接附加到目标
+        client = await browser.attach(target['targetId'])
+        if client is None:
+            logger.error("无法附加到调试目标")
             return
         
         # 等待页面加载完成
-        # await asyncio.sleep(3)
+        await client.wait_for_load()
+        await client.wait_for_selector(EDITOR_CSS_SELECTOR)
         
         # 用户提供的选择器
-        css_selector = "#app > div > div.yb-layout__content.agent-layout__content > div > div > div.agent-dialogue__content > div > div.Pane.vertical.Pane1 > div > div.agent-dialogue__content--common__input.agent-chat__input-box > div > div.agent-dialogue__content--common__input-box > div > div > div.style__text-area__wrapper___W6mrC > div.style__text-area__start___z71p8.style__tooltipLiteBox___avW6d > div > div > div > div > p"
+        css_selector = EDITOR_CSS_SELECTOR
         # 要输入的文本
         text_to_input = "Is life so dear or peace so sweet as to be purchased at the price of chains and slavery? Forbid it, Almighty God! I know not what course others may take; but as for me, give me liberty or give me death!"
         # 提交按钮的CSS选择器
-        submit_button_css_selector = "#yuanbao-send-btn > span"
+        submit_button_css_selector = SUBMIT_BUTTON_CSS_SELECTOR
         # 反馈元素的CSS选择器
-        feedback_css_selector = "#chat-content"
+        feedback_css_selector = FEEDBACK_CSS_SELECTOR
         '''
         # 测试CSS选择器
         found, element_info = await test_selector(client, "CSS选择器", css_selector)
@@ -547,8 +1392,8 @@ async def main():
             logger.warning("未找到提交按钮，无法执行点击操作")
         '''
 
-        # 点击提交按钮
-        await asyncio.sleep(1)
+        # 等待提交按钮可用后点击
+        await client.wait_for_element_enabled(submit_button_css_selector)
         await click_element(client, submit_button_css_selector)
         
     except KeyboardInterrupt:
@@ -558,8 +1403,8 @@ async def main():
         import traceback
         logger.error(traceback.format_exc())
     finally:
-        # 关闭连接
-        await client.close()
+        # 关闭连接（会话随浏览器连接一起关闭）
+        await browser.close()
 
 if __name__ == "__main__":
     try: